@@ -70,6 +70,25 @@ def exemplar(name, val):
             newval = reader.read(io)
             self.assertEqual(val, newval)
 
+        def test_reencode_json_single_pass(self):
+            io = StringIO()
+            writer = Writer(io, protocol="json")
+            writer.write(val)
+            io = StringIO(io.getvalue())
+            reader = Reader(protocol="json", opts={"single_pass": True})
+            newval = reader.read(io)
+            self.assertEqual(val, newval)
+
+        def test_reencode_lazy(self):
+            for protocol, stream in (("json", StringIO), ("msgpack", BytesIO)):
+                io = stream()
+                writer = Writer(io, protocol=protocol)
+                writer.write(val)
+                io = stream(io.getvalue())
+                reader = Reader(protocol=protocol, opts={"lazy": True})
+                newval = reader.read(io)
+                self.assertEqual(val, newval)
+
         # test json verbose
         def test_reencode_json_verbose(self):
             io = StringIO()
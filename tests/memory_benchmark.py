@@ -0,0 +1,50 @@
+## Copyright 2014 Cognitect. All Rights Reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS-IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+from transit.transit_types import Keyword, Symbol, TaggedValue, URI, Link, \
+    true
+import sys
+import tracemalloc
+
+
+def instance_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def allocated(make, count):
+    tracemalloc.start()
+    objs = [make(i) for i in range(count)]
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return current
+
+
+print("-"*50)
+print("Per-instance size (bytes, excluding the values held)")
+print("-"*50)
+for obj in [Keyword("ns/name"), Symbol("ns/name"), TaggedValue("point", 1),
+            URI("http://example.com"), Link("href", "rel"), true]:
+    print(type(obj).__name__ + ": " + str(instance_size(obj)))
+
+runs = 1000000
+names = ["ns/key" + str(i) for i in range(runs)]
+print("-"*50)
+print("Allocating " + str(runs) + " keywords")
+print("-"*50)
+total = allocated(lambda i: Keyword(names[i]), runs)
+print("Total: " + str(total) + "  --  per keyword: " + str(total / runs))
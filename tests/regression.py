@@ -13,13 +13,21 @@
 ## limitations under the License.
 
 # This test suite verifies that issues corrected remain corrected.
+import asyncio
+import sys
+import types
 import unittest
 import json
+import msgpack
+import pickle
 from transit.reader import Reader
 from transit.writer import Writer
 from transit.class_hash import ClassDict
-from transit.transit_types import Symbol, frozendict, true, false, Keyword, Named
-from transit.pyversion import unicode_type
+from transit.rolling_cache import ReadCache, CACHE_SIZE, encode_key
+from transit.lazy import LazyMap, LazyVector, NOT_DECODED
+from transit.transit_types import Symbol, frozendict, true, false, Keyword, Named, TaggedValue, \
+    Set, URI, Link
+from transit.pyversion import unicode_type, PY3
 from decimal import Decimal
 from io import BytesIO, StringIO
 
@@ -115,6 +123,1044 @@ class BooleanTest(unittest.TestCase):
         assert true and true
         assert not (false and false)
 
+class CountingStringIO(StringIO):
+    def __init__(self):
+        StringIO.__init__(self)
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return StringIO.write(self, s)
+
+class JsonBufferedWriteTest(unittest.TestCase):
+    """JsonMarshaler buffers its output and hands it to the io in a single
+    write per top-level value unless told otherwise.
+    """
+    value = [{"a": i, "b": [u"x\ny", None, True, 1.5]} for i in range(100)]
+
+    def write_value(self, opts):
+        io = CountingStringIO()
+        w = Writer(io, "json", opts)
+        w.write(self.value)
+        return io
+
+    def test_single_write(self):
+        io = self.write_value({})
+        self.assertEqual(io.writes, 1)
+
+    def test_same_output(self):
+        buffered = self.write_value({})
+        unbuffered = self.write_value({"buffered": False})
+        assert unbuffered.writes > 100
+        self.assertEqual(buffered.getvalue(), unbuffered.getvalue())
+
+    def test_flush_threshold(self):
+        io = self.write_value({"flush_threshold": 64})
+        assert io.writes > 1
+        self.assertEqual(io.getvalue(), self.write_value({}).getvalue())
+
+    def test_flush_threshold_flat(self):
+        io = CountingStringIO()
+        Writer(io, "json", {"flush_threshold": 64}).write(["x" * 10] * 1000)
+        assert io.writes >= 1000 * 2 // 64
+        self.assertEqual(json.loads(io.getvalue()), ["x" * 10] * 1000)
+
+    def test_flush_threshold_chars(self):
+        io = CountingStringIO()
+        Writer(io, "json", {"flush_threshold": 1000}).write(["x" * 600] * 10)
+        self.assertEqual(io.writes, 5)
+        io = CountingStringIO()
+        Writer(io, "json", {"flush_threshold": 1000}).write([1] * 400)
+        self.assertEqual(io.writes, 1)
+
+    def test_failed_value_discarded(self):
+        class Unknown(object):
+            pass
+        for opts in ({}, {"backend": "json"}):
+            io = StringIO()
+            w = Writer(io, "json", opts)
+            with w.session() as session:
+                session.write([1])
+                self.assertRaises(Exception, session.write,
+                                  [[2, {"a": Unknown()}]])
+                session.write([3])
+            self.assertEqual(io.getvalue(), u'[1][3]')
+
+class JsonStringEscapeTest(unittest.TestCase):
+    value = u"q\"b\\c\x01\x1f\b\f\n\r\t\u00e9\u2028\U0001f600"
+
+    def write_value(self, opts):
+        io = StringIO()
+        Writer(io, "json", opts).write([self.value])
+        return io.getvalue()
+
+    def test_escapes(self):
+        s = self.write_value({})
+        self.assertEqual(s, u"[\"q\\\"b\\\\c\\u0001\\u001f\\b\\f\\n\\r\\t"
+                            u"\u00e9\u2028\U0001f600\"]")
+        self.assertEqual(json.loads(s), [self.value])
+
+    def test_ensure_ascii(self):
+        s = self.write_value({"ensure_ascii": True})
+        assert all(ord(c) < 128 for c in s)
+        self.assertEqual(Reader("json").read(StringIO(s)), (self.value,))
+
+class JsonTreeBackendTest(unittest.TestCase):
+    """Writers with a 'backend' build a plain tree and serialize it in one
+    call; the output must match the streaming JsonMarshaler.
+    """
+    value = ({Keyword("kw"): (1, 2.5, None, false),
+              "~tilde": Symbol("sym"),
+              (1, 2): frozenset([u"caf\u00e9"])},
+             ({Keyword("kw"): 2**60}, {Keyword("kw"): Decimal("1.5")}))
+
+    def write_value(self, protocol, opts):
+        io = StringIO()
+        Writer(io, protocol, opts).write(self.value)
+        return io.getvalue()
+
+    def test_same_output(self):
+        for protocol in ("json", "json_verbose"):
+            self.assertEqual(self.write_value(protocol, {"backend": "json"}),
+                             self.write_value(protocol, {}))
+
+    def test_callable_backend(self):
+        trees = []
+        def dumps(tree):
+            trees.append(tree)
+            return json.dumps(tree, separators=(",", ":"),
+                              ensure_ascii=False).encode("utf-8")
+        s = self.write_value("json", {"backend": dumps})
+        self.assertEqual(len(trees), 1)
+        self.assertEqual(s, self.write_value("json", {}))
+        self.assertEqual(Reader("json").read(StringIO(s)), self.value)
+
+    def test_module_backend(self):
+        module = types.ModuleType("fake_json_backend")
+        module.dumps = lambda tree: json.dumps(tree, separators=(",", ":"),
+                                               ensure_ascii=False)
+        sys.modules["fake_json_backend"] = module
+        try:
+            s = self.write_value("json", {"backend": "fake_json_backend"})
+        finally:
+            del sys.modules["fake_json_backend"]
+        self.assertEqual(s, self.write_value("json", {}))
+
+    def test_module_backend_ensure_ascii(self):
+        opts = {"backend": "json", "ensure_ascii": True}
+        self.assertEqual(self.write_value("json", opts),
+                         self.write_value("json", {"ensure_ascii": True}))
+
+    def test_failed_write_discarded(self):
+        io = StringIO()
+        w = Writer(io, "json", {"backend": "json"})
+        self.assertRaises(KeyError, w.write, [1, object()])
+        w.write([2])
+        self.assertEqual(io.getvalue(), u"[2]")
+
+class PointHandler(object):
+    @staticmethod
+    def tag(_):
+        return "point"
+
+    @staticmethod
+    def rep(p):
+        return [p.x, p.y]
+
+    @staticmethod
+    def string_rep(p):
+        return None
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class StrDict(dict):
+    pass
+
+class StrDictHandler(object):
+    @staticmethod
+    def tag(_):
+        return "strdict"
+
+    @staticmethod
+    def rep(d):
+        return sorted(d)
+
+    @staticmethod
+    def string_rep(d):
+        return None
+
+class MarshalerDispatchCacheTest(unittest.TestCase):
+    def test_register_invalidates(self):
+        io = StringIO()
+        w = Writer(io, "json")
+        w.write([StrDict(a=1)])
+        w.register(StrDict, StrDictHandler)
+        w.write([StrDict(a=1)])
+        assert io.getvalue().endswith(u'[["~#strdict",["a"]]]')
+
+    def test_subclass_dispatch(self):
+        io = StringIO()
+        w = Writer(io, "json")
+        w.register(Point, PointHandler)
+        w.write([StrDict(a=Point(1, 2)), StrDict(a=Point(3, 4))])
+        self.assertEqual(io.getvalue(),
+                         u'[["^ ","a",["~#point",[1,2]]],["^ ","a",["^0",[3,4]]]]')
+
+class WriteCacheTest(unittest.TestCase):
+    """Repeated map keys, keywords, symbols and tags are written as cache
+    codes, and the reader expands them back.
+    """
+    value = tuple(frozendict({"long-key": Keyword("kw/abc"),
+                              Keyword("key"): Symbol("sym/abc"),
+                              "tagged": TaggedValue("point", (i, i))})
+                  for i in range(3))
+
+    def test_json(self):
+        io = StringIO()
+        Writer(io, "json").write(self.value)
+        s = io.getvalue()
+        parsed = json.loads(s)
+        self.assertEqual(parsed[0][1:], ["long-key", "~:kw/abc", "~:key", "~$sym/abc",
+                                         "tagged", ["~#point", [0, 0]]])
+        self.assertEqual(parsed[1][1:], ["^0", "^1", "^2", "^3", "^4", ["^5", [1, 1]]])
+        self.assertEqual(Reader("json").read(StringIO(s)), self.value)
+
+    def test_msgpack(self):
+        io = BytesIO()
+        Writer(io, "msgpack").write(self.value)
+        s = io.getvalue()
+        assert s.count(b"long-key") == 1 and s.count(b"~#point") == 1
+        self.assertEqual(Reader("msgpack").read(BytesIO(s)), self.value)
+
+    def test_not_cached_in_verbose(self):
+        io = StringIO()
+        Writer(io, "json_verbose").write(self.value)
+        assert "^" not in io.getvalue()
+
+class CacheRolloverTest(unittest.TestCase):
+    """The write and read caches both start over from the first code once
+    CACHE_SIZE values have been cached, as the other transit
+    implementations do.
+    """
+    def test_write_rollover(self):
+        kws = [Keyword("key%04d" % i) for i in range(CACHE_SIZE + 1)]
+        io = StringIO()
+        Writer(io, "json").write(kws + [kws[CACHE_SIZE], kws[0]])
+        s = io.getvalue()
+        self.assertEqual(json.loads(s)[-2:], ["^0", "~:key0000"])
+        self.assertEqual(Reader("json").read(StringIO(s)),
+                         tuple(kws + [kws[CACHE_SIZE], kws[0]]))
+
+    def test_read_rollover(self):
+        cache = ReadCache()
+        for i in range(CACHE_SIZE + 2):
+            cache.decode("~:key%04d" % i)
+        self.assertEqual(cache.decode(encode_key(0)), "~:key%04d" % CACHE_SIZE)
+        self.assertEqual(cache.decode(encode_key(2)), "~:key0002")
+
+    def test_first_element_cached_once(self):
+        data = u'["~:abcd","~:efgh","^1"]'
+        self.assertEqual(Reader("json").read(StringIO(data)),
+                         (Keyword("abcd"), Keyword("efgh"), Keyword("efgh")))
+
+class FlushCountingStringIO(StringIO):
+    def __init__(self, data=u""):
+        StringIO.__init__(self, data)
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+class WriteManyTest(unittest.TestCase):
+    def test_cache_recycled(self):
+        w = Writer(StringIO(), "json")
+        session = w.session()
+        session.write([Keyword("abcd")])
+        value_to_code = session.cache.value_to_code
+        session.write([Keyword("abcd"), Keyword("abcd")])
+        assert session.cache.value_to_code is value_to_code
+        self.assertEqual(len(value_to_code), 1)
+
+    def test_top_level_scalars(self):
+        io = StringIO()
+        w = Writer(io, "json")
+        w.write_many(["abc", 1, None])
+        self.assertEqual(io.getvalue(),
+                         u'["~#\'","abc"]["~#\'",1]["~#\'",null]')
+
+    values = [{Keyword("id"): i, Keyword("tags"): (Keyword("tag"),)} for i in range(25)]
+
+    def test_json(self):
+        io = FlushCountingStringIO()
+        Writer(io, "json").write_many(self.values, flush_every=10)
+        self.assertEqual(io.flushes, 3)
+        s = io.getvalue()
+        self.assertEqual(s.count("~:tags"), 25)
+        self.assertEqual(list(Reader("json").readeach(StringIO(s))), self.values)
+
+    def test_msgpack(self):
+        io = BytesIO()
+        w = Writer(io, "msgpack")
+        with w.session() as session:
+            for v in self.values:
+                session.write(v)
+            self.assertEqual(io.getvalue(), b"")
+        r = Reader("msgpack")
+        self.assertEqual(list(r.readeach(BytesIO(io.getvalue()))), self.values)
+
+    def test_flush_bytes(self):
+        for protocol, stream in (("json", FlushCountingStringIO),
+                                 ("msgpack", FlushCountingBytesIO)):
+            io = stream()
+            Writer(io, protocol).write_many(self.values, flush_bytes=100)
+            assert io.flushes > 5
+            r = Reader(protocol)
+            self.assertEqual(list(r.readeach(stream(io.getvalue()))),
+                             self.values)
+
+    def test_exception_in_session(self):
+        io = StringIO()
+        w = Writer(io, "json")
+        try:
+            with w.session() as session:
+                session.write([1])
+                w.marshaler.emit_array_start(2)
+                w.marshaler.emit_object(2)
+                raise KeyError()
+        except KeyError:
+            pass
+        self.assertEqual(io.getvalue(), u"[1]")
+        w.write([3])
+        self.assertEqual(io.getvalue(), u"[1][3]")
+
+class FlushCountingBytesIO(BytesIO):
+    def __init__(self, data=b""):
+        BytesIO.__init__(self, data)
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+class JsonTopLevelSeparatorTest(unittest.TestCase):
+    """Consecutive top-level values are separate JSON texts; a ',' between
+    them made the stream unreadable.
+    """
+    def test_no_separator(self):
+        for protocol in ("json", "json_verbose"):
+            io = StringIO()
+            w = Writer(io, protocol)
+            w.write([1])
+            w.write({"a": 2})
+            decoder = json.JSONDecoder()
+            s = io.getvalue()
+            first, end = decoder.raw_decode(s)
+            second, end = decoder.raw_decode(s, end)
+            self.assertEqual(end, len(s))
+
+class FakeStreamWriter(object):
+    def __init__(self):
+        self.data = b""
+        self.drains = 0
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        self.drains += 1
+
+if PY3:
+    from transit.writer import AsyncWriter
+
+    class AsyncWriterTest(unittest.TestCase):
+        values = [{Keyword("id"): i, Keyword("name"): u"caf\u00e9"} for i in range(50)]
+
+        def write_values(self, protocol, **kwargs):
+            stream = FakeStreamWriter()
+            w = AsyncWriter(stream, protocol, **kwargs)
+            asyncio.run(w.write_many(self.values))
+            return stream
+
+        def test_json(self):
+            stream = self.write_values("json", drain_threshold=256)
+            assert stream.drains > 1
+            io = StringIO()
+            Writer(io, "json").write_many(self.values)
+            self.assertEqual(stream.data, io.getvalue().encode("utf-8"))
+
+        def test_msgpack(self):
+            stream = self.write_values("msgpack")
+            self.assertEqual(stream.drains, 0)
+            r = Reader("msgpack")
+            self.assertEqual(list(r.readeach(BytesIO(stream.data))), self.values)
+
+        def test_executor(self):
+            stream = FakeStreamWriter()
+            w = AsyncWriter(stream, "json", executor_threshold=10)
+            asyncio.run(w.write(list(range(100))))
+            self.assertEqual(json.loads(stream.data.decode("utf-8")), list(range(100)))
+
+        def test_executor_nested(self):
+            from concurrent.futures import ThreadPoolExecutor
+            class CountingExecutor(ThreadPoolExecutor):
+                submitted = 0
+                def submit(self, *args, **kwargs):
+                    self.submitted += 1
+                    return ThreadPoolExecutor.submit(self, *args, **kwargs)
+            executor = CountingExecutor(1)
+            w = AsyncWriter(FakeStreamWriter(), "json", executor_threshold=100,
+                            executor=executor)
+            asyncio.run(w.write({"a": [list(range(10))] * 10}))
+            asyncio.run(w.write([u"x" * 1000]))
+            executor.shutdown()
+            self.assertEqual(executor.submitted, 1)
+
+        def test_size_hint(self):
+            from transit.async_writer import size_hint
+            self.assertEqual(size_hint(1, 100), 1)
+            self.assertEqual(size_hint(u"x" * 1000, 100), 1)
+            self.assertEqual(size_hint({"a": [1, (2, 3)], "b": set([4])}, 100), 10)
+            self.assertEqual(size_hint([list(range(1000))] * 1000, 100), 100)
+
+if PY3:
+    from transit.reader import AsyncReader
+
+    class AsyncReaderTest(unittest.TestCase):
+        values = [{Keyword("id"): i, Keyword("name"): u"caf\u00e9"} for i in range(50)]
+
+        def read_values(self, protocol, data, **kwargs):
+            async def read():
+                stream = asyncio.StreamReader()
+                for i in range(0, len(data), 7):
+                    stream.feed_data(data[i:i + 7])
+                stream.feed_eof()
+                r = AsyncReader(protocol, chunk_size=5, **kwargs)
+                return [v async for v in r.iter(stream)]
+            return asyncio.run(read())
+
+        def test_json(self):
+            io = StringIO()
+            Writer(io, "json").write_many(self.values)
+            data = io.getvalue().encode("utf-8")
+            self.assertEqual(self.read_values("json", data), self.values)
+            self.assertEqual(self.read_values("json", data, executor_threshold=10),
+                             self.values)
+
+        def test_msgpack(self):
+            io = BytesIO()
+            Writer(io, "msgpack").write_many(self.values)
+            data = io.getvalue()
+            self.assertEqual(self.read_values("msgpack", data), self.values)
+            self.assertEqual(self.read_values("msgpack", data, executor_threshold=10),
+                             self.values)
+
+class JsonReadEachTest(unittest.TestCase):
+    def test_stops_at_eof(self):
+        r = Reader("json")
+        self.assertEqual(list(r.readeach(StringIO(u'[1,2]["^ ","a",1]'))),
+                         [(1, 2), frozendict(a=1)])
+
+    def test_brackets_in_strings(self):
+        data = u'["~:a[b","{\\"}"] \n ["^ ","~:a[b",1]'
+        for chunk_size in (1, 3, 65536):
+            r = Reader("json")
+            self.assertEqual(list(r.readeach(StringIO(data), chunk_size=chunk_size)),
+                             [(Keyword("a[b"), u'{"}'), frozendict({Keyword("a[b"): 1})])
+
+    def test_binary_stream(self):
+        data = u'["caf\u00e9"]["\u00e9"]'.encode("utf-8")
+        r = Reader("json")
+        self.assertEqual(list(r.readeach(BytesIO(data), chunk_size=4)),
+                         [(u"caf\u00e9",), (u"\u00e9",)])
+
+    def test_truncated(self):
+        r = Reader("json")
+        self.assertRaises(ValueError, list, r.readeach(StringIO(u'[1,2][3')))
+
+    def test_escapes_across_chunks(self):
+        data = u'["a\\\\","\\"]","\\\\\\"["] ["~:b"]'
+        for chunk_size in range(1, 8):
+            r = Reader("json")
+            self.assertEqual(list(r.readeach(StringIO(data), chunk_size=chunk_size)),
+                             [(u"a\\", u'"]', u'\\"['), (Keyword("b"),)])
+
+    def test_scanner_scalars(self):
+        from transit.sosjson import JsonScanner
+        scanner = JsonScanner()
+        values = []
+        for text in (u"12", u"3 -2500.", u"0 [1", u"]", u" 4"):
+            scanner.feed(text)
+            values.extend(v for v, _ in scanner.scan())
+        values.extend(v for v, _ in scanner.scan(final=True))
+        self.assertEqual(values, [123, -2500.0, [1], 4])
+
+class SinglePassJsonTest(unittest.TestCase):
+    def read(self, data, opts={}):
+        return Reader("json", opts).read(StringIO(data))
+
+    def assertSameAsTree(self, data):
+        self.assertEqual(self.read(data, {"single_pass": True}), self.read(data))
+
+    def test_cache_order(self):
+        value = [{Keyword("k%04d" % i): [Keyword("v%04d" % i), Symbol("sym%d" % i)]}
+                 for i in range(CACHE_SIZE + 50)]
+        io = StringIO()
+        Writer(io, "json").write(value)
+        self.assertSameAsTree(io.getvalue())
+
+    def test_tags(self):
+        self.assertSameAsTree(u'["^ ",["~#list",["~:abcd","^1"]],{"~#set":["~:abcd"]},'
+                              u'"~:key",["~#cmap",[["~:abcd"],"^1"]]]')
+        self.assertSameAsTree(u'{"~#point":[1,"~:abcd"]}')
+        self.assertSameAsTree(u'["~#point",[1,"~:abcd"]]')
+
+    def test_literals(self):
+        self.assertSameAsTree(u' [ null , true,false,-1.5e3,0,"\\u00e9\\n", {},[]] ')
+
+    def test_errors(self):
+        for data in (u'[1,2', u'[1,]', u'{"a" 1}', u'[1] [2]', u'["^ ","a"]', u'nul'):
+            self.assertRaises(ValueError, self.read, data, {"single_pass": True})
+
+    def test_readeach(self):
+        data = u'["^ ","~:abcd",1]\n{"~:abcd":"~:abcd"}[1,2'
+        r = Reader("json", {"single_pass": True})
+        items = r.readeach(StringIO(data + u"]"), chunk_size=3)
+        self.assertEqual(list(items),
+                         [frozendict({Keyword("abcd"): 1}),
+                          frozendict({Keyword("abcd"): Keyword("abcd")}), (1, 2)])
+        self.assertRaises(ValueError, list, r.readeach(StringIO(data)))
+
+class MsgPackNodesTest(unittest.TestCase):
+    def test_tuple_nodes(self):
+        from transit.decoder import Decoder
+        node = ["~:abcd", ["^ ", "~:efgh", ["^0", "^1"]], {"~#set": ["^1"]}]
+        expected = (Keyword("abcd"), frozendict({Keyword("efgh"): (Keyword("abcd"), Keyword("efgh"))}),
+                    frozenset([Keyword("efgh")]))
+        self.assertEqual(Decoder().decode(node), expected)
+        to_tuples = lambda n: tuple(map(to_tuples, n)) if isinstance(n, list) else \
+            dict((k, to_tuples(v)) for k, v in n.items()) if isinstance(n, dict) else n
+        self.assertEqual(Decoder().decode(to_tuples(node)), expected)
+
+    def test_cmap_rollover(self):
+        value = dict(((Keyword("k%04d" % i), i), [Symbol("s%04d" % i)]) for i in range(CACHE_SIZE + 10))
+        io = BytesIO()
+        Writer(io, "msgpack").write(value)
+        self.assertEqual(Reader("msgpack").read(BytesIO(io.getvalue())),
+                         frozendict(((k, tuple(v)) for k, v in value.items())))
+
+class DeepDecodeTest(unittest.TestCase):
+    def nested(self, depth):
+        node = ["~:abcd"]
+        for _ in range(depth - 1):
+            node = ["^ ", "~:abcd", [node]]
+        return node
+
+    def test_deeper_than_recursion_limit(self):
+        from transit.decoder import Decoder
+        depth = sys.getrecursionlimit() * 3
+        value = Decoder().decode(self.nested(depth))
+        levels = 1
+        while value != (Keyword("abcd"),):
+            value = value[Keyword("abcd")][0]
+            levels += 1
+        self.assertEqual(levels, depth)
+
+    def test_max_depth(self):
+        data = json.dumps(self.nested(5))
+        for opts in ({"max_depth": 9}, {"max_depth": 9, "single_pass": True}):
+            self.assertEqual(Reader("json", opts).read(StringIO(data)),
+                             Reader("json").read(StringIO(data)))
+            opts["max_depth"] = 8
+            self.assertRaises(ValueError, Reader("json", opts).read, StringIO(data))
+        io = BytesIO()
+        msgpack.pack(self.nested(5), io)
+        self.assertRaises(ValueError, Reader("msgpack", {"max_depth": 8}).read,
+                          BytesIO(io.getvalue()))
+
+class DeepMarshalTest(unittest.TestCase):
+    def nested(self, depth):
+        value = [1]
+        for _ in range(depth - 1):
+            value = [value]
+        return value
+
+    def test_deeper_than_recursion_limit(self):
+        depth = sys.getrecursionlimit() * 3
+        io = StringIO()
+        Writer(io, "json").write(self.nested(depth))
+        self.assertEqual(io.getvalue(), u"[" * depth + u"1" + u"]" * depth)
+        io = BytesIO()
+        Writer(io, "msgpack").write(self.nested(depth))
+        self.assertEqual(io.getvalue(), b"\x91" * depth + b"\x01")
+
+    def test_max_depth(self):
+        value = {Keyword("abcd"): [TaggedValue("point", [1, 2])]}
+        for protocol, io in (("json", StringIO), ("json_verbose", StringIO),
+                             ("msgpack", BytesIO)):
+            expected = io()
+            Writer(expected, protocol).write(value)
+            out = io()
+            Writer(out, protocol, {"max_depth": 4}).write(value)
+            self.assertEqual(out.getvalue(), expected.getvalue())
+            self.assertRaises(ValueError, Writer(io(), protocol, {"max_depth": 3}).write,
+                              value)
+
+    def test_max_depth_past_direct_depth(self):
+        value = self.nested(50)
+        for protocol in ("json", "msgpack"):
+            Writer(BytesIO() if protocol == "msgpack" else StringIO(),
+                   protocol, {"max_depth": 50}).write(value)
+            self.assertRaises(ValueError,
+                              Writer(StringIO(), protocol, {"max_depth": 49}).write,
+                              value)
+
+    def test_write_after_max_depth(self):
+        for protocol, io in (("json", StringIO), ("json_verbose", StringIO),
+                             ("msgpack", BytesIO)):
+            r = Reader("msgpack" if protocol == "msgpack" else "json")
+            for depth in (3, 100):
+                out = io()
+                w = Writer(out, protocol, {"max_depth": depth - 1})
+                w.write([2])
+                self.assertRaises(ValueError, w.write, self.nested(depth))
+                w.write([3])
+                self.assertEqual(list(r.readeach(io(out.getvalue()))),
+                                 [(2,), (3,)])
+
+class NodeSubclassTest(unittest.TestCase):
+    def test_subclass_nodes(self):
+        from transit.decoder import Decoder, json_node_types
+        class Text(unicode_type): pass
+        class Array(list): pass
+        class Map(dict): pass
+        class Int(int): pass
+        node = Array([Text("~:abcd"), Map({Text("^0"): Int(1)}), (Text("^0"),)])
+        expected = (Keyword("abcd"), frozendict({Keyword("abcd"): 1}), (Keyword("abcd"),))
+        for options in ({}, {"node_types": json_node_types}):
+            decoder = Decoder(options)
+            self.assertEqual(decoder.decode(node), expected)
+            self.assertEqual(decoder.decode(node), expected)
+
+class MapAsArrayDecodeTest(unittest.TestCase):
+    def read(self, data):
+        return Reader("json").read(StringIO(data))
+
+    def test_container_keys_and_values(self):
+        self.assertEqual(self.read(u'["^ ","~:abcd",1,{"~#set":["^0"]},["^0","~:efgh"],'
+                                   u'"~:efgh",{"~:ijkl":"^2"}]'),
+                         frozendict({Keyword("abcd"): 1,
+                                     frozenset([Keyword("abcd")]): (Keyword("abcd"), Keyword("efgh")),
+                                     Keyword("efgh"): frozendict({Keyword("ijkl"): Keyword("efgh")})}))
+
+    def test_trailing_key_ignored(self):
+        self.assertEqual(self.read(u'[["^ ","~:abcd",1,"~:efgh"],"^0"]'),
+                         (frozendict({Keyword("abcd"): 1}), Keyword("abcd")))
+        self.assertEqual(self.read(u'[["^ ","~:abcd"],"~:efgh","^0"]'),
+                         (frozendict(), Keyword("efgh"), Keyword("efgh")))
+
+    def test_large_array(self):
+        data = [u"~:k%d" % i for i in range(100)] + \
+               [encode_key(i % 100) for i in range(4900)]
+        self.assertEqual(self.read(json.dumps(data)),
+                         tuple(Keyword("k%d" % (i % 100)) for i in range(5000)))
+
+class FrozenDictTest(unittest.TestCase):
+    def test_reads(self):
+        d = frozendict({Keyword("a"): 1, "b": (2,)})
+        self.assertEqual(d[Keyword("a")], 1)
+        self.assertEqual(d.get("c"), None)
+        self.assertEqual(len(d), 2)
+        self.assertEqual(d, {Keyword("a"): 1, "b": (2,)})
+        self.assertEqual(frozendict(a=1), frozendict([("a", 1)]))
+        self.assertEqual(repr(frozendict(a=1)), "frozendict({'a': 1})")
+
+    def test_immutable(self):
+        d = frozendict(a=1)
+        for mutate in (lambda: d.__setitem__("a", 2), lambda: d.__delitem__("a"),
+                       d.clear, lambda: d.pop("a"), d.popitem,
+                       lambda: d.setdefault("b", 2), lambda: d.update(b=2)):
+            self.assertRaises(TypeError, mutate)
+        self.assertEqual(d, {"a": 1})
+
+    def test_init_again(self):
+        d = frozendict(a=1)
+        h = hash(d)
+        d.__init__({"b": 2})
+        self.assertEqual(d, {"a": 1})
+        self.assertEqual(hash(d), h)
+
+    def test_builder(self):
+        from transit.transit_types import FrozenDictBuilder
+        b = FrozenDictBuilder()
+        b["a"] = 1
+        d = b.freeze()
+        self.assertIs(d, b)
+        self.assertIs(type(d), frozendict)
+        self.assertEqual(d, frozendict(a=1))
+        self.assertRaises(TypeError, d.__setitem__, "a", 2)
+
+    def test_decoded_maps(self):
+        for data in (u'["^ ","a",1,"b",{"c":2}]', u'{"~:a":{"b":2,"c":3}}'):
+            for opts in ({}, {"single_pass": True}):
+                value = Reader("json", opts).read(StringIO(data))
+                self.assertIs(type(value), frozendict)
+                for v in value.values():
+                    if isinstance(v, dict):
+                        self.assertIs(type(v), frozendict)
+                self.assertRaises(TypeError, value.__setitem__, "a", 2)
+
+    def test_hash(self):
+        d = frozendict({Keyword("a"): (1, 2)})
+        self.assertEqual(hash(d), hash(frozendict({Keyword("a"): (1, 2)})))
+        self.assertEqual(hash(d), hash(d))
+        self.assertEqual({d: 1}[frozendict({Keyword("a"): (1, 2)})], 1)
+
+    def test_pickle(self):
+        import pickle
+        d = frozendict({Keyword("a"): frozendict(b=2)})
+        self.assertEqual(pickle.loads(pickle.dumps(d)), d)
+        self.assertIs(type(pickle.loads(pickle.dumps(d))), frozendict)
+        self.assertIs(type(frozendict.fromkeys("ab")), frozendict)
+
+class PlainOutputTest(unittest.TestCase):
+    value = {Keyword("abcd"): [True, False, None, 1.5, {"x": [{}]}],
+             (1, 2): frozenset([(3, 4)]),
+             True: "t",
+             "list": [[], ()]}
+    expected = {Keyword("abcd"): [True, False, None, 1.5, {"x": [{}]}],
+                (1, 2): set([(3, 4)]),
+                True: "t",
+                "list": [[], []]}
+
+    def assertPlain(self, value):
+        tp = type(value)
+        self.assertIn(tp, (dict, list, set, bool, Keyword, unicode_type, float, int, type(None)))
+        children = []
+        if tp is dict:
+            children = list(value.keys()) + list(value.values())
+        elif tp in (list, set):
+            children = value
+        for child in children:
+            if type(child) is tuple:  # frozen map key or set element
+                continue
+            self.assertPlain(child)
+
+    def test_plain(self):
+        for protocol, io, opts in (("json", StringIO, {}),
+                                   ("json", StringIO, {"single_pass": True}),
+                                   ("json_verbose", StringIO, {}),
+                                   ("msgpack", BytesIO, {})):
+            out = io()
+            Writer(out, protocol).write(self.value)
+            opts = dict(opts, output="plain")
+            result = Reader(protocol, opts).read(io(out.getvalue()))
+            self.assertEqual(result, self.expected)
+            self.assertPlain(result)
+
+    def test_frozen_keys(self):
+        data = u'["^ ",["~#list",[1,["^ ","a",[2]]]],1,"~?t",["~#set",[[3]]]]'
+        result = Reader("json", {"output": "plain"}).read(StringIO(data))
+        self.assertEqual(result, {(1, frozendict(a=(2,))): 1, True: set([(3,)])})
+
+    def test_bad_output(self):
+        self.assertRaises(ValueError, Reader, "json", {"output": "lists"})
+
+class CompactTypesTest(unittest.TestCase):
+    def test_no_instance_dict(self):
+        for obj in (Keyword("a"), Symbol("a"), TaggedValue("t", 1),
+                    Set(frozenset()), URI("http://x"), Link("h", "r"), true):
+            self.assertFalse(hasattr(obj, "__dict__"))
+
+    def test_name_and_namespace(self):
+        k = Keyword("ns/a/b")
+        self.assertEqual(k.namespace, "ns")
+        self.assertEqual(k.name, "a/b")
+        self.assertEqual(Symbol("a").namespace, None)
+
+    def test_tagged_value_hash(self):
+        a = TaggedValue("point", [1, 2])
+        b = TaggedValue("point", [1, 2])
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len(set([a, b, TaggedValue("point", [2, 1])])), 2)
+
+    def test_pickle(self):
+        values = [Keyword("ns/a"), Symbol("b"), TaggedValue("t", (1, 2)),
+                  Set(frozenset([1])), URI("http://x"),
+                  Link("h", "r", name="n", render="image")]
+        for value in values:
+            copy = pickle.loads(pickle.dumps(value, 2))
+            self.assertEqual(copy, value)
+            self.assertIs(type(copy), type(value))
+        self.assertEqual(pickle.loads(pickle.dumps(Keyword("ns/a"), 0)).name,
+                         "a")
+        self.assertIs(pickle.loads(pickle.dumps(true)), true)
+        self.assertIs(pickle.loads(pickle.dumps(false, 0)), false)
+
+    def test_link_as_map(self):
+        l = Link("h", "r", prompt="p")
+        self.assertEqual(l.as_map, {Link.HREF: "h", Link.REL: "r",
+                                    Link.NAME: None, Link.RENDER: None,
+                                    Link.PROMPT: "p"})
+        self.assertNotEqual(l, Link("h", "r"))
+
+
+class InternTest(unittest.TestCase):
+    data = '[["^ ","~:user/id",1,"name","a"],["^ ","~:user/id",2,"name","b"],' \
+           '"~$sym","~$sym"]'
+
+    def read(self, opts, data=None):
+        return Reader("json", opts).read(StringIO(data or self.data))
+
+    def test_shared_objects(self):
+        value = self.read({"intern_size": 100})
+        first, second = [list(m.keys()) for m in value[:2]]
+        self.assertIs(first[0], second[0])
+        self.assertIs(value[2], value[3])
+        name = [k for k in first if k == "name"][0]
+        self.assertIs(name, sys.intern("name") if PY3 else name)
+
+    def test_off_by_default(self):
+        value = self.read({})
+        self.assertIsNot(list(value[0].keys())[0], list(value[1].keys())[0])
+        self.assertEqual(value, self.read({"intern_size": 100}))
+
+    def test_bounded(self):
+        reader = Reader("json", {"intern_size": 2})
+        decoder = reader.reader.decoder
+        reader.read(StringIO('["~:a","~:b"]'))
+        self.assertEqual(len(decoder.interned), 2)
+        reader.read(StringIO('["~:c"]'))
+        self.assertEqual(list(decoder.interned.keys()), ["~:c"])
+
+    def test_register_clears(self):
+        reader = Reader("json", {"intern_size": 100})
+        reader.read(StringIO('"~:a"'))
+        class UpperHandler(object):
+            @staticmethod
+            def from_rep(v):
+                return v.upper()
+        reader.register(":", UpperHandler)
+        self.assertEqual(reader.read(StringIO('"~:a"')), "A")
+
+
+class ValueCacheTest(unittest.TestCase):
+    data = '[["^ ","~xabc",1],["^ ","^0",2],["^ ","^0",3]]'
+
+    def read(self, opts):
+        calls = []
+
+        class CountingHandler(object):
+            @staticmethod
+            def from_rep(v):
+                calls.append(v)
+                return v.upper()
+        reader = Reader("json", opts)
+        reader.register("x", CountingHandler)
+        return reader.read(StringIO(self.data)), calls
+
+    def test_parsed_once(self):
+        value, calls = self.read({})
+        self.assertEqual(calls, ["abc"])
+        self.assertEqual([list(m.items()) for m in value],
+                         [[("ABC", 1)], [("ABC", 2)], [("ABC", 3)]])
+
+    def test_values_shared(self):
+        value = Reader().read(StringIO('[["^ ","~:abcd",1],["^ ","^0",2]]'))
+        self.assertIs(list(value[0].keys())[0], list(value[1].keys())[0])
+
+    def test_disabled(self):
+        value, calls = self.read({"cache_values": False})
+        self.assertEqual(calls, ["abc"] * 3)
+        self.assertEqual(value, self.read({})[0])
+
+    def test_unknown_code(self):
+        value = Reader().read(StringIO('["~:abcd","^1","^0"]'))
+        self.assertEqual(value, (Keyword("abcd"), "^1", Keyword("abcd")))
+
+
+class LazyReadTest(unittest.TestCase):
+    value = {Keyword("items"): tuple({Keyword("id"): i,
+                                      Keyword("tags"): frozenset([Keyword("a")]),
+                                      (Keyword("pair"), i): (Symbol("sym"), i)}
+                                     for i in range(5)),
+             Keyword("keys"): dict((Keyword("key%d" % i), i)
+                                   for i in range(CACHE_SIZE + 10)),
+             Keyword("envelope"): {Keyword("type"): Keyword("items"),
+                                   "uri": URI("http://example.com")}}
+
+    def roundtrip(self, protocol, value, opts={"lazy": True}):
+        io = BytesIO() if protocol == "msgpack" else StringIO()
+        Writer(io, protocol).write(value)
+        io.seek(0)
+        return Reader(protocol, opts).read(io)
+
+    def test_equal_to_eager(self):
+        for protocol in ("json", "json_verbose", "msgpack"):
+            lazy = self.roundtrip(protocol, self.value)
+            self.assertIsInstance(lazy, LazyMap)
+            self.assertEqual(lazy, self.value)
+            self.assertEqual(self.value, lazy)
+            self.assertEqual(lazy, self.roundtrip(protocol, self.value, {}))
+
+    def test_decoded_on_access(self):
+        lazy = self.roundtrip("json", self.value)
+        items = lazy[Keyword("items")]
+        self.assertIsInstance(items, LazyVector)
+        self.assertEqual(items.decoded.count(NOT_DECODED), 5)
+        self.assertEqual(items[-1][Keyword("id")], 4)
+        self.assertEqual(items.decoded.count(NOT_DECODED), 4)
+        self.assertIs(items[-1], items[4])
+        self.assertEqual(items[1:3], self.value[Keyword("items")][1:3])
+        self.assertEqual(lazy[Keyword("keys")][Keyword("key1940")], 1940)
+
+    def test_tagged_values(self):
+        value = [frozenset([1]), TaggedValue("custom", (1, 2)),
+                 {Keyword("abcd"): (frozenset([2]), "~x")}]
+        for protocol in ("json", "msgpack"):
+            self.assertEqual(self.roundtrip(protocol, value), tuple(value))
+
+    def test_plain(self):
+        lazy = self.roundtrip("json", self.value,
+                              {"lazy": True, "output": "plain"})
+        self.assertEqual(lazy[Keyword("items")][0][Keyword("tags")],
+                         set([Keyword("a")]))
+
+    def test_options(self):
+        self.assertRaises(ValueError, Reader, "json",
+                          {"lazy": True, "single_pass": True})
+        self.assertRaises(ValueError, self.roundtrip, "json", [[[1]]],
+                          {"lazy": True, "max_depth": 2})
+
+
+class SelectTest(unittest.TestCase):
+    message = {Keyword("type"): Keyword("order"),
+               Keyword("id"): 42,
+               Keyword("route"): {Keyword("to"): "billing", "hops": (1, 2)},
+               Keyword("body"): {Keyword("lines"): tuple(
+                   {Keyword("sku"): "sku%d" % i, Keyword("qty"): i}
+                   for i in range(50)),
+                   Keyword("type"): Keyword("inner")}}
+    envelope = [(Keyword("type"),), (Keyword("id"),),
+                (Keyword("route"), Keyword("to"))]
+
+    def write(self, protocol, values):
+        io = BytesIO() if protocol == "msgpack" else StringIO()
+        w = Writer(io, protocol)
+        for value in values:
+            w.write(value)
+            if protocol != "msgpack":
+                io.write(u"\n")
+        io.seek(0)
+        return io
+
+    def test_select(self):
+        expected = {Keyword("type"): Keyword("order"), Keyword("id"): 42,
+                    Keyword("route"): {Keyword("to"): "billing"}}
+        for protocol in ("json", "json_verbose", "msgpack"):
+            for opts in ({}, {"lazy": True}, {"output": "plain"}):
+                io = self.write(protocol, [self.message])
+                value = Reader(protocol, opts).read(io, select=self.envelope)
+                self.assertEqual(value, expected)
+
+    def test_paths(self):
+        io = self.write("json", [self.message])
+        value = Reader().read(io, select=[(Keyword("body"), Keyword("type")),
+                                          (Keyword("body"),),
+                                          (Keyword("id"), Keyword("x")),
+                                          (Keyword("missing"),)])
+        self.assertEqual(value, {Keyword("body"): self.message[Keyword("body")]})
+        io = self.write("json", [self.message])
+        self.assertEqual(Reader().read(io, select=[()]), self.message)
+        io = self.write("json", [[1, 2]])
+        self.assertEqual(Reader().read(io, select=self.envelope), {})
+
+    def test_readeach(self):
+        other = dict(self.message)
+        other[Keyword("id")] = 43
+        for protocol in ("json", "msgpack"):
+            io = self.write(protocol, [self.message, other])
+            ids = [m[Keyword("id")] for m in Reader(protocol).readeach(
+                io, select=[(Keyword("id"),)])]
+            self.assertEqual(ids, [42, 43])
+
+    def test_registered_decoders(self):
+        class UpperHandler(object):
+            @staticmethod
+            def from_rep(v):
+                return v.upper()
+        reader = Reader()
+        reader.read(self.write("json", [1]), select=[()])
+        reader.register("x", UpperHandler)
+        io = StringIO(u'["^ ","~:a","~xabc","~:b","~xdef"]')
+        self.assertEqual(reader.read(io, select=[(Keyword("a"),)]),
+                         {Keyword("a"): "ABC"})
+
+    def test_skipped_values_not_decoded(self):
+        decoded = []
+        class CountingHandler(object):
+            @staticmethod
+            def from_rep(v):
+                decoded.append(v)
+                return v
+        for protocol in ("json", "json_verbose", "msgpack"):
+            reader = Reader("msgpack" if protocol == "msgpack" else "json")
+            reader.register("point", CountingHandler)
+            value = {Keyword("skipped"): [TaggedValue("point", [1, 2]),
+                                          {Keyword("abcd"): Keyword("efgh")}],
+                     Keyword("kept"): {Keyword("abcd"): Keyword("efgh")}}
+            del decoded[:]
+            self.assertEqual(
+                reader.read(self.write(protocol, [value]),
+                            select=[(Keyword("kept"), Keyword("abcd"))]),
+                {Keyword("kept"): {Keyword("abcd"): Keyword("efgh")}})
+            self.assertEqual(decoded, [])
+
+
+class ReadOnlyBytesIO(object):
+    """A stream offering only read(), not readinto."""
+    def __init__(self, data):
+        self.io = BytesIO(data)
+
+    def read(self, n):
+        return self.io.read(n)
+
+class MsgPackReadEachTest(unittest.TestCase):
+    values = [{Keyword("id"): i, Keyword("data"): u"x" * i} for i in range(40)]
+
+    def data(self):
+        io = BytesIO()
+        Writer(io, "msgpack").write_many(self.values)
+        return io.getvalue()
+
+    def test_chunks(self):
+        data = self.data()
+        for chunk_size in (1, 7, 65536):
+            r = Reader("msgpack")
+            self.assertEqual(list(r.readeach(BytesIO(data), chunk_size=chunk_size)),
+                             self.values)
+            self.assertEqual(list(r.readeach(ReadOnlyBytesIO(data), chunk_size=chunk_size)),
+                             self.values)
+
+    def test_fed_unpacker(self):
+        r = Reader("msgpack")
+        r.unpacker.feed(self.data())
+        self.assertEqual(list(r.readeach(None)), self.values)
+
+    def test_max_buffer_size(self):
+        io = BytesIO()
+        Writer(io, "msgpack").write(["x" * 1000])
+        r = Reader("msgpack")
+        self.assertRaises(msgpack.BufferFull, list,
+                          r.readeach(BytesIO(io.getvalue()), chunk_size=64,
+                                     max_buffer_size=256))
+
+    def test_truncated(self):
+        r = Reader("msgpack")
+        self.assertRaises(ValueError, list, r.readeach(BytesIO(self.data()[:-3])))
+
 # Helper classes for inheritance unit test.
 class parent(object):
     pass
@@ -132,6 +1178,24 @@ class ClassDictInheritanceTest(unittest.TestCase):
         cd[parent] = "test"
         assert grandchild in cd
 
+    def test_resolution_invalidated(self):
+        cd = ClassDict()
+        assert grandchild not in cd
+        cd[parent] = "parent"
+        self.assertEqual(cd[grandchild], "parent")
+        cd[child] = "child"
+        self.assertEqual(cd[grandchild], "child")
+        del cd[child]
+        self.assertEqual(cd[grandchild], "parent")
+        del cd[parent]
+        self.assertRaises(KeyError, lambda: cd[grandchild])
+
+    def test_resolve_many(self):
+        cd = ClassDict()
+        cd[child] = "child"
+        self.assertEqual(cd.resolve_many([parent, child, grandchild, int]),
+                         {child: "child", grandchild: "child"})
+
 class NamedTests(unittest.TestCase):
     """ Verify behavior for newly introduced built-in Named name/namespace
     parsing. Accomplished through transit_types.Named, a mixin for
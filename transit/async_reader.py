@@ -0,0 +1,95 @@
+## Copyright 2014 Cognitect. All Rights Reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS-IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+# asyncio support for reading Transit data.  Python 3 only; import
+# AsyncReader from transit.reader.
+
+import asyncio
+import codecs
+import msgpack
+from collections import OrderedDict
+from transit.sosjson import JsonScanner
+
+
+class AsyncReader(object):
+    """Reads a stream of Transit values from an asyncio StreamReader:
+
+        async for value in reader.iter(stream_reader):
+            ...
+
+    Chunks of up to 'chunk_size' bytes are fed into a msgpack Unpacker or an
+    incremental JSON scanner as they arrive, and every completed top-level
+    value is decoded and yielded.  Values whose encoding is at least
+    'executor_threshold' bytes (characters for JSON) are decoded on
+    'executor' (the loop's default executor if None) instead of on the
+    event loop; set 'executor_threshold' to None to always decode inline.
+    """
+    def __init__(self, protocol="json", chunk_size=65536,
+                 executor_threshold=1048576, executor=None):
+        # imported here as transit.reader re-exports this class
+        from transit.reader import Reader, UNPACK_OPTIONS
+        self.unpack_options = UNPACK_OPTIONS
+        self.reader = Reader(protocol)
+        self.protocol = protocol
+        self.decoder = self.reader.reader.decoder
+        self.chunk_size = chunk_size
+        self.executor_threshold = executor_threshold
+        self.executor = executor
+
+    def register(self, key_or_tag, f_val):
+        """Register a custom transit tag and decoder/parser function, as
+        Reader.register.
+        """
+        self.reader.register(key_or_tag, f_val)
+
+    async def decode(self, node, size):
+        if self.executor_threshold is not None and \
+                size >= self.executor_threshold:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor,
+                                              self.decoder.decode, node)
+        return self.decoder.decode(node)
+
+    async def iter(self, stream):
+        """Asynchronously yield each value read from stream until EOF."""
+        if self.protocol == "msgpack":
+            parsed = self.iter_msgpack(stream)
+        else:
+            parsed = self.iter_json(stream)
+        async for node, size in parsed:
+            yield await self.decode(node, size)
+
+    async def iter_msgpack(self, stream):
+        unpacker = msgpack.Unpacker(**self.unpack_options)
+        while True:
+            chunk = await stream.read(self.chunk_size)
+            if not chunk:
+                break
+            unpacker.feed(chunk)
+            start = unpacker.tell()
+            for node in unpacker:
+                end = unpacker.tell()
+                yield node, end - start
+                start = end
+
+    async def iter_json(self, stream):
+        scanner = JsonScanner(object_pairs_hook=OrderedDict)
+        text = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            chunk = await stream.read(self.chunk_size)
+            scanner.feed(text.decode(chunk, not chunk))
+            for entry in scanner.scan(final=not chunk):
+                yield entry
+            if not chunk:
+                break
@@ -0,0 +1,114 @@
+## Copyright 2014 Cognitect. All Rights Reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS-IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+# asyncio support for writing Transit data.  Python 3 only; import
+# AsyncWriter from transit.writer.
+
+import asyncio
+from io import BytesIO, StringIO
+from itertools import chain
+
+
+def size_hint(obj, limit):
+    """Cheap estimate of how much work encoding obj takes: the number of
+    values in it, counting obj itself and, at every level of nesting, the
+    elements of lists, tuples and sets and the keys and values of dicts.
+    Any other value counts as one, whatever its size.  Counting stops once
+    limit is reached, so it visits at most limit values.
+    """
+    count = 0
+    stack = [iter((obj,))]
+    while stack:
+        for obj in stack[-1]:
+            count += 1
+            if count >= limit:
+                return count
+            if isinstance(obj, dict):
+                stack.append(chain.from_iterable(obj.items()))
+                break
+            if isinstance(obj, (list, tuple, set, frozenset)):
+                stack.append(iter(obj))
+                break
+        else:
+            stack.pop()
+    return count
+
+
+class AsyncWriter(object):
+    """Writes Transit data to an asyncio StreamWriter.  Each value is
+    encoded by the regular Marshaler for the protocol into an in-memory
+    buffer and handed to the stream in one write.
+
+    The stream's drain() is awaited once 'drain_threshold' bytes have been
+    written since the last drain, so that a slow peer applies backpressure.
+    Values holding at least 'executor_threshold' values, counted by
+    size_hint through every level of nesting, are encoded on 'executor'
+    (the loop's default executor if None) instead of on the event loop;
+    set 'executor_threshold' to None to always encode inline.
+    """
+    def __init__(self, stream, protocol="json", opts={"cache_enabled": True},
+                 drain_threshold=65536, executor_threshold=10000,
+                 executor=None):
+        # imported here as transit.writer re-exports this class
+        from transit.writer import Writer
+        self.stream = stream
+        self.binary = protocol == "msgpack"
+        self.buffer = BytesIO() if self.binary else StringIO()
+        self.writer = Writer(self.buffer, protocol, opts)
+        self.drain_threshold = drain_threshold
+        self.executor_threshold = executor_threshold
+        self.executor = executor
+        self.pending = 0
+        self.lock = None
+
+    def encode(self, obj):
+        """Marshal obj and return the encoded bytes."""
+        self.writer.write(obj)
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data if self.binary else data.encode("utf-8")
+
+    async def write(self, obj):
+        """Marshal obj into Transit data and write it to the stream."""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            threshold = self.executor_threshold
+            if threshold is not None and \
+                    size_hint(obj, threshold) >= threshold:
+                loop = asyncio.get_running_loop()
+                data = await loop.run_in_executor(self.executor,
+                                                  self.encode, obj)
+            else:
+                data = self.encode(obj)
+            self.stream.write(data)
+            self.pending += len(data)
+            if self.pending >= self.drain_threshold:
+                await self.drain()
+
+    async def write_many(self, objs):
+        """Write each object of an iterable as its own top-level value."""
+        for obj in objs:
+            await self.write(obj)
+
+    async def drain(self):
+        """Wait until the stream's buffer has been flushed to the peer."""
+        self.pending = 0
+        await self.stream.drain()
+
+    def register(self, obj_type, handler_class):
+        """Register custom converters for object types, as Writer.register.
+        """
+        self.writer.register(obj_type, handler_class)
@@ -14,36 +14,67 @@
 from transit import pyversion
 MutableMapping = pyversion.abc.MutableMapping
 
+# Marks a type that was resolved and found to have no entry.
+_MISSING = object()
+
 
 class ClassDict(MutableMapping):
-    """A dictionary that looks up class/type keys with inheritance."""
+    """A dictionary that looks up class/type keys with inheritance.
+
+    Lookups are resolved once per concrete type and remembered, including
+    types for which no entry exists; the resolutions are discarded whenever
+    an entry is added or removed.
+    """
 
     def __init__(self, *args, **kwargs):
         self.store = dict()
+        self.resolved = dict()
         self.update(dict(*args, **kwargs))
 
     def __getitem__(self, key):
         key = key if isinstance(key, type) else type(key)
+        try:
+            value = self.resolved[key]
+        except KeyError:
+            value = self.resolved[key] = self._resolve(key)
+        if value is _MISSING:
+            raise KeyError("No handler found for: " + str(key))
+        return value
+
+    def _resolve(self, key):
         if key in self.store:
             return self.store[key]
-        else:
-            for t in key.__bases__:
-                value = t in self.store and self.store[t]
-                if value:
-                    return value
-            # only use mro if __bases__ doesn't work to
-            # avoid its perf overhead.
-            for t in key.mro():
-                value = t in self.store and self.store[t]
-                if value:
-                    return value
-            raise KeyError("No handler found for: " + str(key))
+        for t in key.__bases__:
+            value = t in self.store and self.store[t]
+            if value:
+                return value
+        # only use mro if __bases__ doesn't work to
+        # avoid its perf overhead.
+        for t in key.mro():
+            value = t in self.store and self.store[t]
+            if value:
+                return value
+        return _MISSING
+
+    def resolve_many(self, types):
+        """Resolve a batch of types up front (e.g. at startup), returning a
+        dict of each type that has an entry to its value.
+        """
+        found = {}
+        for t in types:
+            try:
+                found[t] = self[t]
+            except KeyError:
+                pass
+        return found
 
     def __setitem__(self, key, value):
         self.store[key] = value
+        self.resolved.clear()
 
     def __delitem__(self, key):
         del self.store[key]
+        self.resolved.clear()
 
     def __iter__(self):
         return iter(self.store)
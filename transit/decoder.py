@@ -16,9 +16,43 @@ from collections import OrderedDict
 from transit import pyversion, transit_types
 from transit import read_handlers as rh
 from transit.constants import MAP_AS_ARR, ESC, SUB, RES
-from transit.helpers import pairs
-from transit.rolling_cache import RollingCache, is_cacheable, is_cache_key
-from transit.transit_types import true, false
+from transit.pyversion import intern_string
+from transit.helpers import freeze
+from transit.rolling_cache import ReadCache, is_cacheable, is_cache_key, \
+    CODE_INDEXES, NOT_PARSED
+from transit.transit_types import true, false, FrozenDictBuilder
+
+
+# Decoder frame kinds
+ARRAY, MAP_ARRAY, MAP, SINGLE_KEY, MAP_VALUE, TAGGED = range(6)
+
+# How Decoder._decode treats each type of node produced by the parsers: as
+# an array, as a map, as a scalar returned unchanged, or with the named
+# Decoder method.
+ARRAY_NODE, MAP_NODE, SCALAR_NODE = "array", "map", "scalar"
+
+json_node_types = {list: ARRAY_NODE,
+                   OrderedDict: MAP_NODE,
+                   dict: MAP_NODE,
+                   pyversion.unicode_type: "decode_string",
+                   bool: "decode_bool",
+                   float: SCALAR_NODE,
+                   type(None): SCALAR_NODE}
+
+msgpack_node_types = {tuple: ARRAY_NODE,
+                      list: ARRAY_NODE,
+                      dict: MAP_NODE,
+                      pyversion.unicode_type: "decode_string",
+                      bytes: "decode_bytes",
+                      bool: "decode_bool",
+                      float: SCALAR_NODE,
+                      type(None): SCALAR_NODE}
+
+json_node_types.update(dict.fromkeys(pyversion.int_types, SCALAR_NODE))
+msgpack_node_types.update(dict.fromkeys(pyversion.int_types, SCALAR_NODE))
+
+node_types = dict(json_node_types)
+node_types.update(msgpack_node_types)
 
 
 class Tag(object):
@@ -43,13 +77,29 @@ default_options = {"decoders": {"_": rh.NoneHandler,
                                 "set": rh.SetHandler,
                                 "cmap": rh.CmapHandler,
                                 "'": rh.IdentityHandler},
-                   "default_decoder": rh.DefaultHandler}
+                   "cache_values": True,
+                   "default_decoder": rh.DefaultHandler,
+                   "intern_size": None,
+                   "max_depth": None,
+                   "node_types": node_types,
+                   "output": "transit"}
 
 ground_decoders = {"_": rh.NoneHandler,
                    "?": rh.BooleanHandler,
                    "i": rh.IntHandler,
                    "'": rh.IdentityHandler}
 
+# Replace the decoders producing transit types for 'plain' output.
+plain_decoders = {"?": rh.PlainBooleanHandler,
+                  "set": rh.PlainSetHandler,
+                  "cmap": rh.PlainCmapHandler}
+
+# Prefixes of the strings whose decoded values are interned.
+interned_prefixes = (ESC + ":", ESC + "$")
+
+# Plain values that are not hashable, frozen when used as map keys.
+unhashable_types = (list, dict, set)
+
 
 class Decoder(object):
     """The Decoder is the lowest level entry point for parsing, decoding, and
@@ -61,76 +111,326 @@ class Decoder(object):
     some decoders are silently enforced and cannot be overriden.  These are
     known as Ground Decoders, and are needed to maintain bottom-tier
     compatibility.
+
+    Nested data is decoded without recursion, so its depth is not limited
+    by Python's recursion limit.  Set the 'max_depth' option to reject data
+    with more levels of nested arrays and maps with a ValueError.
+
+    Nodes are dispatched on their exact type with the 'node_types' option,
+    which a Reader sets to the types its protocol's parser produces (see
+    json_node_types); other types, such as subclasses, are resolved on
+    first sight.
+
+    With the 'output' option set to "plain" instead of "transit", maps,
+    arrays, booleans and sets are decoded to mutable dicts, lists, bools
+    and sets rather than frozendicts, tuples, transit Booleans and
+    frozensets.  Maps, arrays and sets used as map keys or set elements
+    are still frozen, as they must be hashable.
+
+    Set the 'intern_size' option to a number of entries to share one
+    Keyword or Symbol object between all occurrences of a name, and to
+    intern the strings used as map keys with sys.intern.  The table of
+    interned values is emptied when it fills up, or when the ":" or "$"
+    decoder is replaced with register.
+
+    Strings that are cached by the writer (map keys, keywords, symbols and
+    tags) are parsed once, at their first occurrence, and every cache code
+    referring to them then returns that same decoded value.  As a result a
+    decoder registered for a tag used in such strings is called once per
+    distinct string rather than once per occurrence, and its return value
+    is shared.  Set the 'cache_values' option to False if a decoder has
+    side effects or returns mutable values, to parse every occurrence.
     """
     def __init__(self, options={}):
         self.options = default_options.copy()
         self.options.update(options)
 
-        self.decoders = self.options["decoders"]
+        self.decoders = dict(self.options["decoders"])
         # Always ensure we control the ground decoders
         self.decoders.update(ground_decoders)
+        self.max_depth = self.options["max_depth"]
+        if self.options["output"] not in ("transit", "plain"):
+            raise ValueError("'output' must be 'transit' or 'plain'.")
+        self.plain = self.options["output"] == "plain"
+        if self.plain:
+            self.decoders.update(plain_decoders)
+        self.intern_size = self.options["intern_size"]
+        self.interned = {} if self.intern_size else None
+        self.cache_values = self.options["cache_values"]
+        self.node_dispatch = {}
+        for tp, kind in self.options["node_types"].items():
+            self.node_dispatch[tp] = self.node_decoder(kind)
 
     def decode(self, node, cache=None, as_map_key=False):
         """Given a node of data (any supported decodeable obj - string, dict,
         list), return the decoded object.  Optionally set the current decode
-        cache [None].  If None, a new RollingCache is instantiated and used.
+        cache [None].  If None, a new ReadCache is instantiated and used.
         You may also hit to the decoder that this node is to be treated as a
         map key [False].  This is used internally.
         """
         if not cache:
-            cache = RollingCache()
+            cache = ReadCache()
         return self._decode(node, cache, as_map_key)
 
     def _decode(self, node, cache, as_map_key):
-        tp = type(node)
-        if tp is pyversion.unicode_type:
-            return self.decode_string(node, cache, as_map_key)
-        elif tp is bytes:
-            return self.decode_string(node.decode("utf-8"), cache, as_map_key)
-        elif tp is dict or tp is OrderedDict:
-            return self.decode_hash(node, cache, as_map_key)
-        elif tp is list:
-            return self.decode_list(node, cache, as_map_key)
-        elif tp is str:
-            return self.decode_string(unicode(node, "utf-8"), cache, as_map_key)
-        elif tp is bool:
-            return true if node else false
-        return node
+        # Containers are decoded with an explicit stack of frames rather
+        # than by recursion.  A frame is [kind, node, position, as_map_key,
+        # accumulator, key]; children are decoded strictly in document
+        # order - map keys before their values - as the cache requires.
+        stack = []
+        max_depth = self.max_depth
+        dispatch = self.node_dispatch
+        plain = self.plain
+        # how to decode node, when already looked up
+        node_kind = None
+        while True:
+            if node_kind is None:
+                tp = type(node)
+                f = dispatch.get(tp) or self.resolve_node(tp)
+            else:
+                f = node_kind
+                node_kind = None
+            if f is ARRAY_NODE:
+                if not node:
+                    value = [] if plain else ()
+                elif node[0] == MAP_AS_ARR:
+                    if len(node) < 3:
+                        value = {} if plain else transit_types.frozendict()
+                    else:
+                        self.check_depth(stack, max_depth)
+                        stack.append([MAP_ARRAY, node, 1, as_map_key,
+                                      {} if plain else FrozenDictBuilder(),
+                                      None])
+                        node = node[1]
+                        as_map_key = True
+                        continue
+                else:
+                    self.check_depth(stack, max_depth)
+                    stack.append([ARRAY, node, 0, as_map_key,
+                                  [None] * len(node), None])
+                    node = node[0]
+                    continue
+            elif f is MAP_NODE:
+                if len(node) == 1:
+                    key, value = next(iter(node.items()))
+                    self.check_depth(stack, max_depth)
+                    stack.append([SINGLE_KEY, value, 0, as_map_key, None,
+                                  None])
+                    node = key
+                    as_map_key = True
+                    continue
+                elif not node:
+                    value = {} if plain else transit_types.frozendict()
+                else:
+                    items = iter(node.items())
+                    key, value = next(items)
+                    self.check_depth(stack, max_depth)
+                    stack.append([MAP, items, value, as_map_key,
+                                  {} if plain else FrozenDictBuilder(), None])
+                    node = key
+                    as_map_key = True
+                    continue
+            elif f is SCALAR_NODE:
+                value = node
+            else:
+                value = f(node, cache, as_map_key)
+
+            # hand the value to the innermost open container, closing every
+            # container it completes, until one has another child to decode
+            while stack:
+                frame = stack[-1]
+                kind = frame[0]
+                # Arrays and map-as-arrays decode the elements that follow
+                # in place, by index, up to the next nested container.
+                if kind is ARRAY:
+                    node = frame[1]
+                    i = frame[2]
+                    if i == 0 and isinstance(value, Tag):
+                        frame[0] = TAGGED
+                        frame[4] = value.tag
+                        node = node[1]
+                        as_map_key = frame[3]
+                        break
+                    items = frame[4]
+                    items[i] = value
+                    as_map_key = frame[3]
+                    i += 1
+                    n = len(node)
+                    while i < n:
+                        child = node[i]
+                        f = dispatch.get(type(child)) or \
+                            self.resolve_node(type(child))
+                        if f is SCALAR_NODE:
+                            items[i] = child
+                        elif f is ARRAY_NODE or f is MAP_NODE:
+                            break
+                        else:
+                            items[i] = f(child, cache, as_map_key)
+                        i += 1
+                    if i < n:
+                        frame[2] = i
+                        node = node[i]
+                        node_kind = f
+                        break
+                    value = items if plain else tuple(items)
+                elif kind is MAP_ARRAY:
+                    # keys are at odd indexes, a trailing key is ignored
+                    node = frame[1]
+                    i = frame[2]
+                    h = frame[4]
+                    key = frame[5]
+                    if i & 1:
+                        key = value
+                        if plain and type(key) in unhashable_types:
+                            key = freeze(key)
+                    else:
+                        h[key] = value
+                    i += 1
+                    n = len(node) if len(node) & 1 else len(node) - 1
+                    while i < n:
+                        child = node[i]
+                        f = dispatch.get(type(child)) or \
+                            self.resolve_node(type(child))
+                        if f is ARRAY_NODE or f is MAP_NODE:
+                            break
+                        if f is not SCALAR_NODE:
+                            child = f(child, cache,
+                                      True if i & 1 else frame[3])
+                        if i & 1:
+                            key = child
+                        else:
+                            h[key] = child
+                        i += 1
+                    if i < n:
+                        frame[2] = i
+                        frame[5] = key
+                        node = node[i]
+                        node_kind = f
+                        as_map_key = True if i & 1 else frame[3]
+                        break
+                    value = h if plain else h.freeze()
+                elif kind is MAP:
+                    if frame[5] is None:
+                        if plain and type(value) in unhashable_types:
+                            value = freeze(value)
+                        frame[5] = (value,)
+                        node = frame[2]
+                        as_map_key = False
+                        break
+                    frame[4][frame[5][0]] = value
+                    item = next(frame[1], None)
+                    if item is not None:
+                        node, frame[2] = item
+                        frame[5] = None
+                        as_map_key = True
+                        break
+                    value = frame[4] if plain else frame[4].freeze()
+                elif kind is SINGLE_KEY:
+                    node = frame[1]
+                    if isinstance(value, Tag):
+                        frame[0] = TAGGED
+                        frame[4] = value.tag
+                        as_map_key = frame[3]
+                    else:
+                        if plain and type(value) in unhashable_types:
+                            value = freeze(value)
+                        frame[0] = MAP_VALUE
+                        frame[5] = value
+                        as_map_key = False
+                    break
+                elif kind is MAP_VALUE:
+                    h = {} if plain else FrozenDictBuilder()
+                    h[frame[5]] = value
+                    value = h if plain else h.freeze()
+                else:
+                    value = self.decode_tag(frame[4], value)
+                stack.pop()
+            else:
+                return value
+
+    def node_decoder(self, kind):
+        if kind in (ARRAY_NODE, MAP_NODE, SCALAR_NODE):
+            return kind
+        return getattr(self, kind)
+
+    def resolve_node(self, tp):
+        """Find how to decode nodes of a type missing from the dispatch
+        table, such as a subclass of a node type, and add it to the table.
+        """
+        for base in tp.__mro__:
+            kind = node_types.get(base)
+            if kind:
+                break
+        else:
+            kind = SCALAR_NODE
+        f = self.node_dispatch[tp] = self.node_decoder(kind)
+        return f
+
+    def check_depth(self, stack, max_depth):
+        if max_depth is not None and len(stack) >= max_depth:
+            raise ValueError("Transit data nested deeper than max_depth (%d)"
+                             % max_depth)
 
     def decode_list(self, node, cache, as_map_key):
-        """Special case decodes map-as-array.
-        Otherwise lists are treated as Python lists.
+        """Decode a list node: a map-as-array, a tagged value or an array.
 
         Arguments follow the same convention as the top-level 'decode'
         function.
         """
-        if node:
-            if node[0] == MAP_AS_ARR:
-                # key must be decoded before value for caching to work.
-                returned_dict = {}
-                for k, v in pairs(node[1:]):
-                    key = self._decode(k, cache, True)
-                    val = self._decode(v, cache, as_map_key)
-                    returned_dict[key] = val
-                return transit_types.frozendict(returned_dict)
-
-            decoded = self._decode(node[0], cache, as_map_key)
-            if isinstance(decoded, Tag):
-                return self.decode_tag(decoded.tag,
-                                       self._decode(node[1], cache, as_map_key))
-        return tuple(self._decode(x, cache, as_map_key) for x in node)
+        return self._decode(node, cache, as_map_key)
 
     def decode_string(self, string, cache, as_map_key):
         """Decode a string - arguments follow the same convention as the
         top-level 'decode' function.
         """
-        if is_cache_key(string):
-            return self.parse_string(cache.decode(string, as_map_key),
-                                     cache, as_map_key)
+        i = CODE_INDEXES.get(string) if is_cache_key(string) else None
+        if i is not None:
+            values = cache.values
+            value = values[i] if i < len(values) else NOT_PARSED
+            if value is NOT_PARSED:
+                value = self.parse_or_intern(cache.entries[i], cache,
+                                             as_map_key)
+                if self.cache_values and i < len(values):
+                    values[i] = value
+            return value
+        if self.interned is not None:
+            value = self.intern(string, cache, as_map_key)
+        else:
+            value = self.parse_string(string, cache, as_map_key)
         if is_cacheable(string, as_map_key):
-            cache.encode(string, as_map_key)
+            cache.encache(string, value if self.cache_values else NOT_PARSED)
+        return value
+
+    def parse_or_intern(self, string, cache, as_map_key):
+        if self.interned is not None:
+            return self.intern(string, cache, as_map_key)
+        return self.parse_string(string, cache, as_map_key)
+
+    def intern(self, string, cache, as_map_key):
+        """Parse a string, returning the value already decoded for a
+        keyword or symbol of the same name, and interning map key strings.
+        """
+        value = self.interned.get(string)
+        if value is not None:
+            return value
+        if string[:2] in interned_prefixes:
+            value = self.parse_string(string, cache, as_map_key)
+            if len(self.interned) >= self.intern_size:
+                self.interned.clear()
+            self.interned[string] = value
+            return value
+        if as_map_key and not string.startswith(ESC):
+            return intern_string(string)
         return self.parse_string(string, cache, as_map_key)
 
+    def decode_bytes(self, string, cache, as_map_key):
+        return self.decode_string(string.decode("utf-8"), cache, as_map_key)
+
+    def decode_bool(self, b, cache, as_map_key):
+        if self.plain:
+            return b
+        return true if b else false
+
     def decode_tag(self, tag, rep):
         decoder = self.decoders.get(tag, None)
         if decoder:
@@ -139,26 +439,12 @@ class Decoder(object):
             return self.options["default_decoder"].from_rep(tag, rep)
 
     def decode_hash(self, hash, cache, as_map_key):
-        if len(hash) != 1:
-            h = {}
-            for k, v in hash.items():
-                # crude/verbose implementation, but this is only version that
-                # plays nice w/cache for both msgpack and json thus far.
-                # -- e.g., we have to specify encode/decode order for key/val
-                # -- explicitly, all implicit ordering has broken in corner
-                # -- cases, thus these extraneous seeming assignments
-                key = self._decode(k, cache, True)
-                val = self._decode(v, cache, False)
-                h[key] = val
-            return transit_types.frozendict(h)
-        else:
-            key = list(hash)[0]
-            value = hash[key]
-            key = self._decode(key, cache, True)
-            if isinstance(key, Tag):
-                return self.decode_tag(key.tag,
-                                       self._decode(value, cache, as_map_key))
-        return transit_types.frozendict({key: self._decode(value, cache, False)})
+        """Decode a map node: a tagged value or a map.
+
+        Arguments follow the same convention as the top-level 'decode'
+        function.
+        """
+        return self._decode(hash, cache, as_map_key)
 
     def parse_string(self, string, cache, as_map_key):
         if string.startswith(ESC):
@@ -184,3 +470,5 @@ class Decoder(object):
             self.options["default_decoder"] = obj
         else:
             self.decoders[key_or_tag] = obj
+            if self.interned and ESC + key_or_tag in interned_prefixes:
+                self.interned.clear()
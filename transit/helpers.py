@@ -14,6 +14,7 @@
 
 import itertools
 from transit.pyversion import imap, izip
+from transit.transit_types import frozendict
 
 
 def mapcat(f, i):
@@ -24,6 +25,20 @@ def pairs(i):
     return izip(*[iter(i)] * 2)
 
 
+def freeze(value):
+    """Return a hashable equivalent of a plain decoded value: lists become
+    tuples, dicts frozendicts and sets frozensets, recursively.
+    """
+    tp = type(value)
+    if tp is list:
+        return tuple(freeze(x) for x in value)
+    if tp is dict:
+        return frozendict((k, freeze(v)) for k, v in value.items())
+    if tp is set:
+        return frozenset(value)
+    return value
+
+
 cycle = itertools.cycle
 
 
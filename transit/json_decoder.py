@@ -0,0 +1,170 @@
+## Copyright 2014 Cognitect. All Rights Reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS-IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+# Single-pass JSON decoding - parses JSON text straight into Transit values,
+# without building an intermediate tree of lists and OrderedDicts.
+
+import re
+from json.decoder import scanstring
+from json.scanner import NUMBER_RE
+from transit import transit_types
+from transit.constants import MAP_AS_ARR
+from transit.decoder import Decoder, Tag, unhashable_types
+from transit.rolling_cache import ReadCache
+from transit.helpers import freeze
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+CONSTANTS = (("null", None),
+             ("true", True),
+             ("false", False),
+             ("NaN", float("nan")),
+             ("Infinity", float("inf")),
+             ("-Infinity", float("-inf")))
+
+
+class JsonDecoder(Decoder):
+    """A Decoder that parses JSON text itself, applying the read cache and
+    tag decoding to each value as it is scanned.  Strings reach the cache in
+    document order - keys before their values - exactly as Decoder.decode
+    sees them in a parsed tree, so both produce the same values.  Nested
+    arrays and objects are parsed recursively; set 'max_depth' to reject
+    deep data with a ValueError before the recursion limit is reached.
+    """
+    def decode_text(self, text, pos=0, cache=None):
+        """Decode the JSON value starting at pos (after any whitespace) and
+        return it with the index just past its text, like
+        json.JSONDecoder.raw_decode.
+        """
+        if not cache:
+            cache = ReadCache()
+        return self.parse_value(text, WHITESPACE.match(text, pos).end(),
+                                cache, False, 0)
+
+    def parse_value(self, s, pos, cache, as_map_key, depth):
+        c = s[pos:pos + 1]
+        if c == '"':
+            string, end = scanstring(s, pos + 1)
+            return self.decode_string(string, cache, as_map_key), end
+        elif c == "[" or c == "{":
+            if self.max_depth is not None and depth >= self.max_depth:
+                raise ValueError("Transit data nested deeper than max_depth "
+                                 "(%d)" % self.max_depth)
+            if c == "[":
+                return self.parse_array(s, pos, cache, as_map_key, depth + 1)
+            return self.parse_object(s, pos, cache, as_map_key, depth + 1)
+        m = NUMBER_RE.match(s, pos)
+        if m:
+            integer, frac, exp = m.groups()
+            if frac or exp:
+                return float(integer + (frac or "") + (exp or "")), m.end()
+            return int(integer), m.end()
+        for literal, value in CONSTANTS:
+            if s.startswith(literal, pos):
+                if type(value) is bool:
+                    value = self.decode_bool(value, cache, as_map_key)
+                return value, pos + len(literal)
+        raise ValueError("Expecting value at char %d" % pos)
+
+    def parse_array(self, s, pos, cache, as_map_key, depth):
+        pos = WHITESPACE.match(s, pos + 1).end()
+        if s[pos:pos + 1] == "]":
+            return [] if self.plain else (), pos + 1
+        if s[pos:pos + 1] == '"':
+            string, pos = scanstring(s, pos + 1)
+            if string == MAP_AS_ARR:
+                return self.parse_map_as_array(s, pos, cache, as_map_key,
+                                               depth)
+            first = self.decode_string(string, cache, as_map_key)
+        else:
+            first, pos = self.parse_value(s, pos, cache, as_map_key, depth)
+        more, pos = self.next_element(s, pos, "]")
+        if isinstance(first, Tag):
+            if not more:
+                raise ValueError("Expecting tagged value at char %d" % pos)
+            rep, pos = self.parse_value(s, pos, cache, as_map_key, depth)
+            more, pos = self.next_element(s, pos, "]")
+            while more:
+                # not part of the tagged value, so not seen by the cache
+                _, pos = self.parse_value(s, pos, ReadCache(), as_map_key,
+                                          depth)
+                more, pos = self.next_element(s, pos, "]")
+            return self.decode_tag(first.tag, rep), pos
+        items = [first]
+        while more:
+            item, pos = self.parse_value(s, pos, cache, as_map_key, depth)
+            items.append(item)
+            more, pos = self.next_element(s, pos, "]")
+        if self.plain:
+            return items, pos
+        return tuple(items), pos
+
+    def parse_map_as_array(self, s, pos, cache, as_map_key, depth):
+        h = {} if self.plain else transit_types.FrozenDictBuilder()
+        more, pos = self.next_element(s, pos, "]")
+        while more:
+            key, pos = self.parse_value(s, pos, cache, True, depth)
+            if self.plain and type(key) in unhashable_types:
+                key = freeze(key)
+            more, pos = self.next_element(s, pos, "]")
+            if not more:
+                raise ValueError("Expecting map value at char %d" % pos)
+            h[key], pos = self.parse_value(s, pos, cache, as_map_key, depth)
+            more, pos = self.next_element(s, pos, "]")
+        if self.plain:
+            return h, pos
+        return h.freeze(), pos
+
+    def parse_object(self, s, pos, cache, as_map_key, depth):
+        pos = WHITESPACE.match(s, pos + 1).end()
+        if s[pos:pos + 1] == "}":
+            return {} if self.plain else transit_types.frozendict(), pos + 1
+        h = {} if self.plain else transit_types.FrozenDictBuilder()
+        first = True
+        while True:
+            if s[pos:pos + 1] != '"':
+                raise ValueError("Expecting property name enclosed in "
+                                 "double quotes at char %d" % pos)
+            string, pos = scanstring(s, pos + 1)
+            key = self.decode_string(string, cache, True)
+            pos = WHITESPACE.match(s, pos).end()
+            if s[pos:pos + 1] != ":":
+                raise ValueError("Expecting ':' delimiter at char %d" % pos)
+            pos = WHITESPACE.match(s, pos + 1).end()
+            tagged = first and isinstance(key, Tag)
+            value, pos = self.parse_value(s, pos, cache,
+                                          as_map_key if tagged else False,
+                                          depth)
+            more, pos = self.next_element(s, pos, "}")
+            if tagged and not more:
+                return self.decode_tag(key.tag, value), pos
+            h[key] = value
+            if not more:
+                if self.plain:
+                    return h, pos
+                return h.freeze(), pos
+            first = False
+
+    def next_element(self, s, pos, closer):
+        """Skip the separator after an element: returns (True, start of the
+        next element) after a comma, (False, end) after the closer.
+        """
+        pos = WHITESPACE.match(s, pos).end()
+        c = s[pos:pos + 1]
+        if c == ",":
+            return True, WHITESPACE.match(s, pos + 1).end()
+        elif c == closer:
+            return False, pos + 1
+        raise ValueError("Expecting ',' delimiter or %r at char %d"
+                         % (closer, pos))
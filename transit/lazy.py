@@ -0,0 +1,433 @@
+## Copyright 2014 Cognitect. All Rights Reserved.
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS-IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+
+# Lazy decoding - maps and arrays are returned as read-only proxies over the
+# parsed nodes, and their children are decoded when first accessed.
+
+from collections import OrderedDict
+from itertools import chain
+from transit import pyversion, transit_types
+from transit.constants import MAP_AS_ARR, SUB
+from transit.decoder import Decoder, Tag, ARRAY_NODE, MAP_NODE, \
+    SCALAR_NODE, node_types, unhashable_types
+from transit.helpers import freeze
+from transit.rolling_cache import ReadCache, CODE_INDEXES, \
+    MIN_SIZE_CACHEABLE
+
+# Resolver frame kinds
+ARRAY, MAP_ARRAY, MAP = range(3)
+
+# Node kinds of strings for the resolver, besides those of Decoder
+STRING_NODE, BYTES_NODE = "string", "bytes"
+
+# Strings cached wherever they appear, not only as map keys.
+CACHEABLE_PREFIXES = ("~#", "~$", "~:")
+
+# Marks a LazyVector element that has not been decoded yet.
+NOT_DECODED = object()
+
+
+def is_tag(node):
+    return isinstance(node, pyversion.string_types) and node.startswith("~#")
+
+
+class ResolvedCache(ReadCache):
+    """The cache used to decode nodes whose cache codes have already been
+    resolved: nothing is cached, and a code decodes to itself.
+    """
+    def encache(self, name, value=None):
+        pass
+
+
+class LazyMap(pyversion.abc.Mapping):
+    """A read-only map over parsed key and value nodes.  The keys are
+    decoded when the map is created, each value when it is first looked up.
+    """
+    __slots__ = ("decoder", "raw", "decoded", "_hash")
+
+    def __init__(self, decoder, keys, values):
+        self.decoder = decoder
+        self.raw = OrderedDict(zip(keys, values))
+        self.decoded = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.decoded[key]
+        except KeyError:
+            value = self.decoded[key] = self.decoder.lazy_value(self.raw[key])
+            return value
+
+    def __contains__(self, key):
+        return key in self.raw
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __repr__(self):
+        return "LazyMap(%r)" % dict(self.items())
+
+
+class LazyVector(pyversion.abc.Sequence):
+    """A read-only sequence over parsed element nodes, each decoded when it
+    is first accessed.
+    """
+    __slots__ = ("decoder", "raw", "decoded")
+
+    def __init__(self, decoder, raw):
+        self.decoder = decoder
+        self.raw = raw
+        self.decoded = [NOT_DECODED] * len(raw)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self[j] for j in range(*i.indices(len(self.raw))))
+        value = self.decoded[i]
+        if value is NOT_DECODED:
+            value = self.decoded[i] = self.decoder.lazy_value(self.raw[i])
+        return value
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __eq__(self, other):
+        if isinstance(other, (tuple, list, LazyVector)):
+            return len(self) == len(other) and \
+                all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return "LazyVector(%r)" % (tuple(self),)
+
+
+class LazyDecoder(Decoder):
+    """A Decoder returning maps and arrays as LazyMap and LazyVector proxies
+    whose contents are decoded on first access; other values, map keys and
+    tagged values are decoded as by Decoder.decode.
+
+    Cache codes refer to strings by their position in the whole document,
+    so decode first makes a pass over the node that only replaces the cache
+    codes with the strings they stand for, copying the containers that held
+    codes.  Each child can then be decoded on its own, in any order.
+    """
+    def __init__(self, options={}):
+        Decoder.__init__(self, options)
+        self.resolved = ResolvedCache()
+        self.resolve_kinds = {}
+        for tp, kind in self.options["node_types"].items():
+            self.resolve_kinds[tp] = self.resolve_kind(kind)
+
+    def decode(self, node, cache=None, as_map_key=False):
+        if not cache:
+            cache = ReadCache()
+        return self.lazy_value(self.resolve_cache(node, cache, as_map_key),
+                               as_map_key)
+
+    @classmethod
+    def like(cls, decoder):
+        """Return a LazyDecoder sharing the options, decoders and interned
+        values of decoder, so that later registrations apply to both.
+        """
+        lazy = cls(decoder.options)
+        lazy.options = decoder.options
+        lazy.decoders = decoder.decoders
+        lazy.interned = decoder.interned
+        return lazy
+
+    def select(self, node, paths, cache=None):
+        """Decode only the values at the given key paths of node, returning
+        them in nested maps holding just the selected keys.  A path is a
+        sequence of decoded map keys, such as (Keyword("data"), "items");
+        paths that run into a missing key or a value that is not a map
+        select nothing, and an empty path selects all of node.  Everything
+        else is only skipped: it is neither decoded nor copied, and its
+        cacheable strings are just added to the read cache.
+        """
+        if not cache:
+            cache = ReadCache()
+        tree = {}
+        for path in paths:
+            if not path:
+                tree = None
+                break
+            branch = tree
+            for key in path[:-1]:
+                sub = branch.setdefault(key, {})
+                if sub is None:
+                    break
+                branch = sub
+            else:
+                branch[path[-1]] = None
+        if tree is None:
+            return self._decode(node, cache, False)
+        h = self.select_map(node, tree, cache)
+        if h is None:
+            return {} if self.plain else transit_types.frozendict()
+        return h
+
+    def select_map(self, node, tree, cache):
+        """Decode the keys of a map node and the values selected by tree,
+        skipping the others, in document order.  Returns None, once node has
+        been skipped, if it is not a map.
+        """
+        tp = type(node)
+        f = self.node_dispatch.get(tp) or self.resolve_node(tp)
+        if f is ARRAY_NODE and node and node[0] == MAP_AS_ARR:
+            # a trailing key is ignored
+            n = len(node) if len(node) & 1 else len(node) - 1
+            pairs = ((node[i], node[i + 1]) for i in range(1, n, 2))
+        elif f is MAP_NODE:
+            pairs = node.items()
+        else:
+            self.skip(node, cache, False)
+            return None
+        h = {} if self.plain else transit_types.FrozenDictBuilder()
+        for key, value in pairs:
+            key = self._decode(key, cache, True)
+            if f is MAP_NODE and len(node) == 1 and isinstance(key, Tag):
+                # a tagged value
+                self.skip(value, cache, False)
+                return None
+            if self.plain and type(key) in unhashable_types:
+                key = freeze(key)
+            if key not in tree:
+                self.skip(value, cache, False)
+            elif tree[key] is None:
+                h[key] = self._decode(value, cache, False)
+            else:
+                value = self.select_map(value, tree[key], cache)
+                if value is not None:
+                    h[key] = value
+        return h if self.plain else h.freeze()
+
+    def skip(self, node, cache, as_map_key):
+        """Visit node only to add the cacheable strings in it to cache, in
+        the order Decoder.decode would, without decoding or copying it.
+        """
+        # A frame is [kind, node, position, end, as_map_key, children]; the
+        # elements of an array node are read by position, those of a map
+        # node from children, an iterator over its keys and values in turn.
+        stack = [[ARRAY, (node,), 0, 1, as_map_key, None]]
+        max_depth = self.max_depth
+        kinds = self.resolve_kinds
+        entries = cache.entries
+        while stack:
+            frame = stack[-1]
+            kind, node, i, end, flag, children = frame
+            while i < end:
+                child = node[i] if children is None else next(children)
+                tp = type(child)
+                k = kinds.get(tp) or self.resolve_type(tp)
+                if k is SCALAR_NODE:
+                    i += 1
+                    continue
+                if kind is ARRAY:
+                    as_map_key = flag
+                elif kind is MAP_ARRAY:
+                    as_map_key = True if i & 1 else flag
+                else:
+                    as_map_key = not i & 1
+                if k is STRING_NODE or k is BYTES_NODE:
+                    value = child.decode("utf-8") if k is BYTES_NODE \
+                        else child
+                    i_code = CODE_INDEXES.get(value) \
+                        if value[:1] == SUB and value != MAP_AS_ARR else None
+                    if i_code is not None:
+                        value = entries[i_code]
+                    elif len(value) >= MIN_SIZE_CACHEABLE and \
+                            (as_map_key or value[:2] in CACHEABLE_PREFIXES):
+                        cache.encache(value)
+                    if i == 0 and is_tag(value):
+                        if kind is ARRAY:
+                            # only the tagged value's rep is decoded
+                            end = min(end, 2)
+                        elif end == 2:
+                            # a tagged value: the rep is decoded as an
+                            # array element would be
+                            kind = ARRAY
+                elif child:
+                    break
+                i += 1
+            if i == end:
+                stack.pop()
+                continue
+            frame[0] = kind
+            frame[2] = i + 1
+            frame[3] = end
+            if max_depth is not None:
+                self.check_depth(stack[1:], max_depth)
+            if k is MAP_NODE:
+                stack.append([MAP, child, 0, 2 * len(child), as_map_key,
+                              chain.from_iterable(child.items())])
+            elif child[0] == MAP_AS_ARR:
+                # a trailing key is ignored
+                n = len(child) if len(child) & 1 else len(child) - 1
+                stack.append([MAP_ARRAY, child, 1, n, as_map_key, None])
+            else:
+                stack.append([ARRAY, child, 0, len(child), as_map_key, None])
+
+    def lazy_value(self, node, as_map_key=False):
+        """Return a proxy for a map or array node with its cache codes
+        resolved, or the decoded value of any other node.
+        """
+        tp = type(node)
+        f = self.node_dispatch.get(tp) or self.resolve_node(tp)
+        if f is ARRAY_NODE and node:
+            if node[0] == MAP_AS_ARR:
+                if len(node) >= 3:
+                    n = len(node) if len(node) & 1 else len(node) - 1
+                    return self.lazy_map(node[1:n:2], node[2:n:2])
+            elif not is_tag(node[0]):
+                return LazyVector(self, node)
+        elif f is MAP_NODE and node:
+            if len(node) > 1 or not is_tag(next(iter(node))):
+                return self.lazy_map(list(node.keys()), list(node.values()))
+        return self._decode(node, self.resolved, as_map_key)
+
+    def lazy_map(self, keys, values):
+        decoded = []
+        for key in keys:
+            key = self._decode(key, self.resolved, True)
+            if self.plain and type(key) in unhashable_types:
+                key = freeze(key)
+            decoded.append(key)
+        return LazyMap(self, decoded, values)
+
+    def resolve_kind(self, kind):
+        if kind == "decode_string":
+            return STRING_NODE
+        if kind == "decode_bytes":
+            return BYTES_NODE
+        if kind in (ARRAY_NODE, MAP_NODE):
+            return kind
+        return SCALAR_NODE
+
+    def resolve_type(self, tp):
+        for base in tp.__mro__:
+            kind = node_types.get(base)
+            if kind:
+                break
+        else:
+            kind = SCALAR_NODE
+        kind = self.resolve_kinds[tp] = self.resolve_kind(kind)
+        return kind
+
+    def resolve_cache(self, node, cache, as_map_key):
+        """Return node with every cache code replaced by the string it
+        stands for, reading and filling cache in the order Decoder.decode
+        would.  Containers are copied only if a code in them was replaced.
+        """
+        # A frame is [kind, children, position, end, as_map_key, copy of
+        # the children or None, node]; the bottom frame holds just node.
+        stack = [[ARRAY, (node,), 0, 1, as_map_key, None, None]]
+        max_depth = self.max_depth
+        kinds = self.resolve_kinds
+        entries = cache.entries
+        while True:
+            frame = stack[-1]
+            kind, children, i, end, flag, out = frame[:6]
+            while i < end:
+                child = children[i]
+                tp = type(child)
+                k = kinds.get(tp) or self.resolve_type(tp)
+                if k is SCALAR_NODE:
+                    i += 1
+                    continue
+                if kind is ARRAY:
+                    as_map_key = flag
+                elif kind is MAP_ARRAY:
+                    as_map_key = True if i & 1 else flag
+                elif not i & 1:
+                    as_map_key = True
+                elif end == 2 and is_tag((out or children)[0]):
+                    as_map_key = flag
+                else:
+                    as_map_key = False
+                if k is STRING_NODE or k is BYTES_NODE:
+                    value = child.decode("utf-8") if k is BYTES_NODE \
+                        else child
+                    i_code = CODE_INDEXES.get(value) \
+                        if value[:1] == SUB and value != MAP_AS_ARR else None
+                    if i_code is not None:
+                        value = entries[i_code]
+                    elif len(value) >= MIN_SIZE_CACHEABLE and \
+                            (as_map_key or value[:2] in CACHEABLE_PREFIXES):
+                        cache.encache(value)
+                    if value is not child:
+                        if out is None:
+                            out = frame[5] = list(children)
+                        out[i] = value
+                    if i == 0 and kind is ARRAY and is_tag(value):
+                        # only the tagged value's rep is decoded
+                        end = min(end, 2)
+                elif k is ARRAY_NODE and child and \
+                        (child[0] != MAP_AS_ARR or len(child) >= 3):
+                    break
+                elif k is MAP_NODE and child:
+                    break
+                i += 1
+            frame[2] = i
+            frame[3] = end
+            if i < end:
+                # child is a container holding strings
+                if max_depth is not None:
+                    self.check_depth(stack[1:], max_depth)
+                if k is MAP_NODE:
+                    children = [x for item in child.items() for x in item]
+                    stack.append([MAP, children, 0, len(children),
+                                  as_map_key, None, child])
+                elif child[0] == MAP_AS_ARR:
+                    # a trailing key is ignored
+                    n = len(child) if len(child) & 1 else len(child) - 1
+                    stack.append([MAP_ARRAY, child, 1, n, as_map_key, None,
+                                  child])
+                else:
+                    stack.append([ARRAY, child, 0, len(child), as_map_key,
+                                  None, child])
+                continue
+
+            stack.pop()
+            if out is None:
+                value = frame[6]
+            elif kind is MAP:
+                value = dict(zip(out[0::2], out[1::2]))
+            elif isinstance(frame[6], list):
+                value = out
+            else:
+                value = tuple(out)
+            if len(stack) == 0:
+                return (out or children)[0]
+            parent = stack[-1]
+            i = parent[2]
+            if value is not parent[1][i]:
+                if parent[5] is None:
+                    parent[5] = list(parent[1])
+                parent[5][i] = value
+            parent[2] = i + 1
@@ -33,6 +33,13 @@ else:
     unicode_type = unicode
     unicode_f = unichr
 
+if PY3:
+    intern_string = sys.intern
+else:
+    def intern_string(s):
+        # Python 2 can only intern byte strings
+        return intern(s) if type(s) is str else s
+
 if PY3:
     long_type = int
     int_type = int
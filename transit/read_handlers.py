@@ -18,7 +18,7 @@ import ctypes
 import dateutil.parser
 import datetime
 import dateutil.tz
-from transit.helpers import pairs
+from transit.helpers import pairs, freeze
 from decimal import Decimal
 
 ## Read handlers are used by the decoder when parsing/reading in Transit
@@ -144,6 +144,24 @@ class CmapHandler(object):
         return transit_types.frozendict(pairs(cmap))
 
 
+class PlainBooleanHandler(object):
+    @staticmethod
+    def from_rep(x):
+        return x == "t"
+
+
+class PlainSetHandler(object):
+    @staticmethod
+    def from_rep(s):
+        return set(freeze(x) for x in s)
+
+
+class PlainCmapHandler(object):
+    @staticmethod
+    def from_rep(cmap):
+        return dict((freeze(k), v) for k, v in pairs(cmap))
+
+
 class IdentityHandler(object):
     @staticmethod
     def from_rep(i):
@@ -15,32 +15,61 @@
 import json
 import msgpack
 from collections import OrderedDict
-from transit import sosjson
-from transit.decoder import Decoder
+from transit import pyversion, sosjson
+from transit.decoder import Decoder, json_node_types, msgpack_node_types
+from transit.json_decoder import JsonDecoder, WHITESPACE
+from transit.lazy import LazyDecoder
+
+
+# Unpacker options producing the cheapest nodes for the Decoder: tuples
+# instead of lists, text already decoded from UTF-8, and plain dicts where
+# they keep insertion order (map keys must be decoded before their values).
+UNPACK_OPTIONS = {"raw": False, "use_list": False}
+if not pyversion.PY3:
+    UNPACK_OPTIONS["object_pairs_hook"] = OrderedDict
+if msgpack.version >= (1, 0):
+    UNPACK_OPTIONS["strict_map_key"] = False
 
 
 class Reader(object):
     """The top-level object for reading in Transit data and converting it to
     Python objects.  During initialization, you must specify the protocol used
     for unmarshalling the data- json or msgpack.
+
+    Options are passed on to the Decoder.  Set 'output' to "plain" to read
+    maps, arrays, booleans and sets as dicts, lists, bools and sets (see
+    Decoder), and 'intern_size' to share decoded keywords, symbols and map
+    key strings between occurrences.  Set 'cache_values' to False if a
+    registered decoder must run for every occurrence of a cached string
+    (see Decoder).  For JSON, set 'single_pass' to decode Transit values while
+    the text is parsed, instead of parsing a complete JSON tree and
+    decoding that - slower per value, but without the intermediate tree in
+    memory.  Set 'lazy' to read maps and arrays as LazyMap and LazyVector
+    proxies that decode their contents on first access (see LazyDecoder).
     """
-    def __init__(self, protocol="json"):
+    def __init__(self, protocol="json", opts={}):
         if protocol in ("json", "json_verbose"):
-            self.reader = JsonUnmarshaler()
+            self.reader = JsonUnmarshaler(opts)
         elif protocol == "msgpack":
-            self.reader = MsgPackUnmarshaler()
+            self.reader = MsgPackUnmarshaler(opts)
             self.unpacker = self.reader.unpacker
         else:
             raise ValueError("'" + protocol + "' is not a supported. " +
                              "Protocol must be:" +
                              "'json', 'json_verbose', or 'msgpack'.")
 
-    def read(self, stream):
+    def read(self, stream, select=None):
         """Given a readable file descriptor object (something `load`able by
         msgpack or json), read the data, and return the Python representation
         of the contents. One-shot reader.
+
+        Pass a list of key paths as 'select' to decode only those values of
+        a map, as in select=[(Keyword("data"), Keyword("items"))]; they are
+        returned in nested maps holding just the selected keys, and the
+        rest of the data is only scanned for the read cache (see
+        LazyDecoder.select).
         """
-        return self.reader.load(stream)
+        return self.reader.load(stream, select)
 
     def register(self, key_or_tag, f_val):
         """Register a custom transit tag and decoder/parser function for use
@@ -50,12 +79,14 @@ class Reader(object):
 
     def readeach(self, stream, **kwargs):
         """Temporary hook for API while streaming reads are in experimental
-        phase. Read each object from stream as available with generator.
-        JSON blocks indefinitely waiting on JSON entities to arrive. MsgPack
-        requires unpacker property to be fed stream using unpacker.feed()
-        method.
+        phase. Read each object from stream as available with generator,
+        until EOF, decoding only the 'select' paths of each if given.
+        Streams are read in chunks of up to 'chunk_size' characters or bytes
+        (default 65536); see MsgPackUnmarshaler.loadeach for the msgpack
+        options. For msgpack, a stream of None reads the
+        values fed to the unpacker property using unpacker.feed() instead.
         """
-        for o in self.reader.loadeach(stream):
+        for o in self.reader.loadeach(stream, **kwargs):
             yield o
 
 
@@ -63,30 +94,122 @@ class JsonUnmarshaler(object):
     """The top-level Unmarshaler used by the Reader for JSON payloads.  While
     you may use this directly, it is strongly discouraged.
     """
-    def __init__(self):
-        self.decoder = Decoder()
+    def __init__(self, opts={}):
+        self.single_pass = opts.get("single_pass", False)
+        options = {"node_types": json_node_types}
+        options.update(opts)
+        if self.single_pass:
+            if opts.get("lazy"):
+                raise ValueError("'single_pass' and 'lazy' cannot be "
+                                 "combined.")
+            self.decoder = JsonDecoder(options)
+        elif opts.get("lazy"):
+            self.decoder = LazyDecoder(options)
+        else:
+            self.decoder = Decoder(options)
+        self.selector = None
+
+    def select(self, paths):
+        """Return a function decoding just the given paths of a node."""
+        if self.selector is None:
+            self.selector = self.decoder \
+                if isinstance(self.decoder, LazyDecoder) \
+                else LazyDecoder.like(self.decoder)
+        return lambda node: self.selector.select(node, paths)
 
-    def load(self, stream):
+    def load(self, stream, select=None):
+        if select is not None:
+            return self.select(select)(json.load(
+                stream, object_pairs_hook=OrderedDict))
+        if self.single_pass:
+            text = stream.read()
+            if not isinstance(text, pyversion.unicode_type):
+                text = text.decode("utf-8")
+            o, end = self.decoder.decode_text(text)
+            if WHITESPACE.match(text, end).end() != len(text):
+                raise ValueError("Extra data at char %d" % end)
+            return o
         return self.decoder.decode(json.load(stream,
                                              object_pairs_hook=OrderedDict))
 
-    def loadeach(self, stream):
-        for o in sosjson.items(stream, object_pairs_hook=OrderedDict):
-            yield self.decoder.decode(o)
+    def loadeach(self, stream, chunk_size=65536, select=None):
+        if self.single_pass and select is None:
+            for o in sosjson.items(stream, chunk_size,
+                                   raw_decode=self.decoder.decode_text):
+                yield o
+            return
+        decode = self.decoder.decode if select is None \
+            else self.select(select)
+        for o in sosjson.items(stream, chunk_size,
+                               object_pairs_hook=OrderedDict):
+            yield decode(o)
 
 
 class MsgPackUnmarshaler(object):
     """The top-level Unmarshaler used by the Reader for MsgPack payloads.
     While you may use this directly, it is strongly discouraged.
     """
-    def __init__(self):
-        self.decoder = Decoder()
-        self.unpacker = msgpack.Unpacker(object_pairs_hook=OrderedDict)
+    def __init__(self, opts={}):
+        options = {"node_types": msgpack_node_types}
+        options.update(opts)
+        if opts.get("lazy"):
+            self.decoder = LazyDecoder(options)
+        else:
+            self.decoder = Decoder(options)
+        self.selector = None
+        self.unpacker = msgpack.Unpacker(**UNPACK_OPTIONS)
+
+    def select(self, paths):
+        """Return a function decoding just the given paths of a node."""
+        if self.selector is None:
+            self.selector = self.decoder \
+                if isinstance(self.decoder, LazyDecoder) \
+                else LazyDecoder.like(self.decoder)
+        return lambda node: self.selector.select(node, paths)
+
+    def load(self, stream, select=None):
+        decode = self.decoder.decode if select is None \
+            else self.select(select)
+        return decode(msgpack.load(stream, **UNPACK_OPTIONS))
+
+    def loadeach(self, stream, chunk_size=65536,
+                 max_buffer_size=100 * 1024 * 1024, select=None):
+        """Read stream in chunks of up to chunk_size bytes - through
+        readinto1/readinto and a reused buffer where the stream supports it
+        - and yield each value as soon as it is complete, until EOF.  Raises
+        msgpack.BufferFull when a single value needs more than
+        max_buffer_size bytes.  If stream is None, yields the values fed
+        into the unpacker property instead.
+        """
+        decode = self.decoder.decode if select is None \
+            else self.select(select)
+        if stream is None:
+            for o in self.unpacker:
+                yield decode(o)
+            return
+        unpacker = msgpack.Unpacker(max_buffer_size=max_buffer_size,
+                                    **UNPACK_OPTIONS)
+        readinto = getattr(stream, "readinto1", None) or \
+                   getattr(stream, "readinto", None)
+        buff = bytearray(chunk_size)
+        view = memoryview(buff)
+        fed = 0
+        while True:
+            if readinto is not None:
+                n = readinto(buff)
+                data = view[:n]
+            else:
+                data = stream.read(chunk_size)
+                n = len(data)
+            if not n:
+                break
+            unpacker.feed(data)
+            fed += n
+            for o in unpacker:
+                yield decode(o)
+        if unpacker.tell() != fed:
+            raise ValueError("Unexpected end of msgpack stream")
 
-    def load(self, stream):
-        return self.decoder.decode(msgpack.load(stream,
-                                                object_pairs_hook=OrderedDict))
 
-    def loadeach(self, stream):
-        for o in self.unpacker:
-            yield self.decoder.decode(o)
+if pyversion.PY3:
+    from transit.async_reader import AsyncReader
@@ -19,25 +19,32 @@ CACHE_CODE_DIGITS = 44
 CACHE_SIZE = CACHE_CODE_DIGITS * CACHE_CODE_DIGITS
 MIN_SIZE_CACHEABLE = 4
 
+# Marks a ReadCache slot whose string has no decoded value stored.
+NOT_PARSED = object()
+
+
+def _code(i):
+    lo = i % CACHE_CODE_DIGITS
+    hi = i // CACHE_CODE_DIGITS
+    if hi == 0:
+        return SUB + chr(lo + FIRST_ORD)
+    return SUB + chr(hi + FIRST_ORD) + chr(lo + FIRST_ORD)
+
+# Precomputed cache code <-> cache index tables.
+CACHE_CODES = [_code(i) for i in range(CACHE_SIZE)]
+CODE_INDEXES = dict((code, i) for i, code in enumerate(CACHE_CODES))
+
 
 def is_cache_key(name):
     return len(name) and (name[0] == SUB and name != MAP_AS_ARR)
 
 
 def encode_key(i):
-    lo = i % CACHE_CODE_DIGITS
-    hi = i // CACHE_CODE_DIGITS
-    if hi == 0:
-        return "^" + chr(lo + FIRST_ORD)
-    return "^" + chr(hi + FIRST_ORD) + chr(lo + FIRST_ORD)
+    return CACHE_CODES[i]
 
 
 def decode_key(s):
-    sz = len(s)
-    if sz == 2:
-        return ord(s[1]) - FIRST_ORD
-    return (ord(s[2]) - FIRST_ORD) + \
-           (CACHE_CODE_DIGITS * (ord(s[1]) - FIRST_ORD))
+    return CODE_INDEXES[s]
 
 
 def is_cacheable(string, as_map_key=False):
@@ -46,47 +53,68 @@ def is_cacheable(string, as_map_key=False):
                   or (string[:2] in ["~#", "~$", "~:"]))
 
 
-class RollingCache(object):
-    """This is the internal cache used by python-transit for cacheing and
-    expanding map keys during writing and reading.  The cache enables transit
-    to minimize the amount of duplicate data sent over the wire, effectively
-    compressing down the overall payload size.  The cache is not intended to
-    be used directly.
+class ReadCache(object):
+    """The cache used while reading transit to expand cache codes back into
+    the strings they stand for.  Entries live in a fixed list of CACHE_SIZE
+    slots indexed by cache code; once every slot has been used, the next
+    entry rolls over to slot 0.  Alongside each string, a slot can hold the
+    value the string decoded to, so that the Decoder parses it only once.
+    The cache is not intended to be used directly.
     """
     def __init__(self):
-        self.key_to_value = {}
-        self.value_to_key = {}
+        # Slots that were never filled hold their own code, so an unknown
+        # code decodes to itself.  Their values are not stored at all.
+        self.entries = list(CACHE_CODES)
+        self.values = []
+        self.index = 0
 
-    # if index rolls over... (bug)
     def decode(self, name, as_map_key=False):
-        """Always returns the name"""
-        if is_cache_key(name) and (name in self.key_to_value):
-            return self.key_to_value[name]
-        return self.encache(name) if is_cacheable(name, as_map_key) else name
-
-    def encode(self, name, as_map_key=False):
-        """Returns the name the first time and the key after that"""
-        if name in self.key_to_value:
-            return self.key_to_value[name]
-        return self.encache(name) if is_cacheable(name, as_map_key) else name
+        """Returns the value for a cache code.  Any other name is returned
+        unchanged, and cached if it is cacheable.
+        """
+        i = CODE_INDEXES.get(name)
+        if i is not None:
+            return self.entries[i]
+        if is_cacheable(name, as_map_key):
+            self.encache(name)
+        return name
 
-    def size(self):
-        return len(self.key_to_value)
+    def encache(self, name, value=NOT_PARSED):
+        if self.index == CACHE_SIZE:
+            self.index = 0
+        self.entries[self.index] = name
+        if self.index < len(self.values):
+            self.values[self.index] = value
+        else:
+            self.values.append(value)
+        self.index += 1
 
-    def is_cache_full(self):
-        return len(self.key_to_value) > CACHE_SIZE
+    def clear(self):
+        self.index = 0
 
-    def encache(self, name):
-        if self.is_cache_full():
-            self.clear()
-        elif name in self.value_to_key:
-            return self.value_to_key[name]
 
-        key = encode_key(len(self.key_to_value))
-        self.key_to_value[key] = name
-        self.value_to_key[name] = key
+class WriteCache(object):
+    """The cache used while writing transit to replace repeated map keys,
+    keywords, symbols and tags with short cache codes, minimizing the
+    amount of duplicate data sent over the wire.  When CACHE_SIZE values
+    have been cached the cache starts over from the first code.  The cache
+    is not intended to be used directly.
+    """
+    def __init__(self):
+        self.value_to_code = {}
 
+    def encode(self, name, as_map_key=False):
+        """Returns the name the first time and the code after that."""
+        if is_cacheable(name, as_map_key):
+            code = self.value_to_code.get(name)
+            if code is not None:
+                return code
+            size = len(self.value_to_code)
+            if size == CACHE_SIZE:
+                self.clear()
+                size = 0
+            self.value_to_code[name] = CACHE_CODES[size]
         return name
 
     def clear(self):
-        self.value_to_key = {}
+        self.value_to_code.clear()
@@ -11,67 +11,202 @@
 ## without warranties or conditions of any kind, either express or implied.
 ## see the license for the specific language governing permissions and
 ## limitations under the license.
-# Simple object streaming in Python - just reads one complete JSON object
-# at a time and returns json.loads of that string.
+# Simple object streaming in Python - splits a stream of concatenated JSON
+# texts into values as they become available.
 
-# Ugly implementation at moment
-from copy import copy
+import codecs
 import json
+import re
+from transit.pyversion import unicode_type
 
-SKIP = [" ", "\n", "\t"]
-ESCAPE = "\\"
 
-
-def read_chunk(stream):
-    """Ignore whitespace outside of strings. If we hit a string, read it in
-    its entirety.
+def read_chunks(stream, chunk_size=65536):
+    """Yield text from stream as it becomes available, until EOF.  A text
+    stream over a buffered binary stream (such as sys.stdin) is read
+    through the binary stream's read1, so that whatever has arrived is
+    returned instead of blocking until chunk_size characters are read; do
+    not mix this with reads made directly on the text stream.  Binary
+    streams are decoded as UTF-8.
     """
-    chunk = stream.read(1)
-    while chunk in SKIP:
-        chunk = stream.read(1)
-    if chunk == "\"":
-        chunk += stream.read(1)
-        while not chunk.endswith("\""):
-            if chunk[-1] == ESCAPE:
-                chunk += stream.read(2)
-            else:
-                chunk += stream.read(1)
-    return chunk
+    raw = getattr(stream, "buffer", None)
+    if raw is not None and hasattr(raw, "read1"):
+        read = raw.read1
+        encoding = getattr(stream, "encoding", None) or "utf-8"
+    else:
+        read = stream.read
+        encoding = "utf-8"
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = read(chunk_size)
+        if not data:
+            if not isinstance(data, unicode_type):
+                decoder.decode(data, True)  # raises on a truncated character
+            return
+        if not isinstance(data, unicode_type):
+            data = decoder.decode(data)
+        if data:
+            yield data
 
 
-def items(stream, **kwargs):
-    """External facing items. Will return item from stream as available.
-    Currently waits in loop waiting for next item. Can pass keywords that
-    json.loads accepts (such as object_pairs_hook)
+def items(stream, chunk_size=65536, **kwargs):
+    """External facing items. Will return item from stream as available,
+    until EOF. Can pass keywords that JsonScanner accepts (such as
+    object_pairs_hook)
     """
-    for s in yield_json(stream):
-        yield json.loads(s, **kwargs)
+    scanner = JsonScanner(**kwargs)
+    for text in read_chunks(stream, chunk_size):
+        scanner.feed(text)
+        for value, _ in scanner.scan():
+            yield value
+    for value, _ in scanner.scan(final=True):
+        yield value
 
 
-def yield_json(stream):
-    """Uses array and object delimiter counts for balancing.
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Outside strings: a complete string, a bracket, or the quote opening a
+# string that continues past the end of the text.
+TOKENS = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}"]', re.S)
+# Inside a string: the text up to the closing quote or the end.
+STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+SCALAR_END = re.compile(r'[ \t\n\r\[\]{}",:]')
+
+
+class JsonScanner(object):
+    """Incremental splitter for a stream of concatenated JSON texts.  Feed it
+    text as it arrives and iterate scan() for every value that is complete.
+    Values are parsed with json.JSONDecoder.raw_decode.  The text of the
+    next value is kept as a list of chunks; a value that does not end in
+    the chunk it starts in is scanned once, tracking the nesting of
+    brackets outside strings, and parsed only once it is complete, joining
+    its chunks a single time.  Accepts the keywords that json.JSONDecoder
+    does (such as object_pairs_hook), or a replacement raw_decode(text,
+    pos) function returning (value, end).
     """
-    buff = u""
-    arr_count = 0
-    obj_count = 0
-    while True:
-        buff += read_chunk(stream)
+    def __init__(self, raw_decode=None, **kwargs):
+        self.raw_decode = raw_decode or json.JSONDecoder(**kwargs).raw_decode
+        # Text from the start of the next value, which is at start in the
+        # first chunk; scanning resumes at offset in chunks[index].
+        self.chunks = []
+        self.start = 0
+        self.index = 0
+        self.offset = 0
+        self.reset()
+
+    def reset(self):
+        self.begun = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.scalar = False
+
+    def feed(self, text):
+        if text:
+            self.chunks.append(text)
+
+    def scan(self, final=False):
+        """Yield (value, size) for each complete value in the buffer, size
+        being the length of its text.  With final, the input is known to be
+        over: incomplete text raises ValueError rather than waiting.
+        """
+        chunks = self.chunks
+        while chunks:
+            if not self.begun:
+                text = chunks[0]
+                pos = WHITESPACE.match(text, self.start).end()
+                if pos == len(text):
+                    # only whitespace before the next value
+                    del chunks[0]
+                    self.start = 0
+                    continue
+                self.start = self.offset = pos
+                self.begun = True
+                self.scalar = text[pos] not in "[{\""
+                # most values end in the chunk they start in
+                try:
+                    value, stop = self.raw_decode(text, pos)
+                except ValueError:
+                    pass
+                else:
+                    # a number at the end of the text may still continue
+                    if not self.scalar or SCALAR_END.match(text, stop):
+                        self.start = stop
+                        self.reset()
+                        yield value, stop - pos
+                        continue
+            end = self.find_end()
+            if end is None:
+                if not final:
+                    return
+                if not self.scalar:
+                    # raises the error for the incomplete value
+                    self.raw_decode(u"".join(chunks)[self.start:], 0)
+                    raise ValueError("Incomplete JSON value")
+                self.index = len(chunks) - 1
+                end = len(chunks[-1])
+            i = self.index
+            if i == 0:
+                value, stop = self.raw_decode(chunks[0], self.start)
+                size = stop - self.start
+            else:
+                text = u"".join([chunks[0][self.start:]] + chunks[1:i] +
+                                [chunks[i][:end]])
+                value, size = self.raw_decode(text, 0)
+                stop = end - len(text) + size
+                del chunks[:i]
+            self.start = stop
+            self.index = 0
+            self.reset()
+            yield value, size
+
+    def find_end(self):
+        """Scan the chunks from where the last scan stopped, returning the
+        end of the value in chunks[index] once it is complete, or None.
+        """
+        chunks = self.chunks
+        while self.index < len(chunks):
+            end = self.advance(chunks[self.index], self.offset)
+            if end is not None:
+                return end
+            self.index += 1
+            self.offset = 0
+        return None
 
-        # If we finish parsing all objs or arrays, yield a finished JSON
-        # entity.
-        if buff.endswith('{'):
-            obj_count += 1
-        if buff.endswith('['):
-            arr_count += 1
-        if buff.endswith(']'):
-            arr_count -= 1
-            if obj_count == arr_count == 0:
-                json_item = copy(buff)
-                buff = u""
-                yield json_item
-        if buff.endswith('}'):
-            obj_count -= 1
-            if obj_count == arr_count == 0:
-                json_item = copy(buff)
-                buff = u""
-                yield json_item
+    def advance(self, text, pos):
+        """Scan text from pos, returning the end of the value if it ends in
+        text, or None.
+        """
+        if self.scalar:
+            m = SCALAR_END.search(text, pos)
+            return m.start() if m else None
+        depth = self.depth
+        if self.in_string:
+            if self.escaped:
+                pos += 1
+            pos = STRING_REST.match(text, pos).end()
+            if pos >= len(text):
+                self.escaped = False
+                return None
+            if text[pos] == "\\":
+                self.escaped = True
+                return None
+            self.in_string = False
+            pos += 1
+            if depth == 0:
+                return pos
+        for m in TOKENS.finditer(text, pos):
+            c = text[m.start()]
+            if c == "[" or c == "{":
+                depth += 1
+                continue
+            if c == "]" or c == "}":
+                depth -= 1
+            elif m.end() - m.start() == 1:
+                # the string goes on in the next text
+                self.depth = depth
+                self.in_string = True
+                self.escaped = False
+                return self.advance(text, m.end())
+            if depth <= 0:
+                return m.end()
+        self.depth = depth
+        return None
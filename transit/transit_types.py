@@ -12,13 +12,21 @@
 ## See the License for the specific language governing permissions and
 ## limitations under the License.
 from transit import pyversion
-Mapping = pyversion.abc.Mapping
-Hashable = pyversion.abc.Hashable
 
 from transit.pyversion import string_types, unicode_f, unicode_type
 
 
 class Named(object):
+    """Base for Keyword and Symbol.  The string and its hash are stored at
+    construction; name and namespace are split out on first use and kept.
+    """
+    __slots__ = ("str", "hv", "_name", "_namespace")
+
+    def __init__(self, value):
+        assert isinstance(value, string_types)
+        self.str = value
+        self.hv = value.__hash__()
+
     def _parse(self):
         p = self.str.split('/', 1)
         if len(p) == 1:
@@ -27,65 +35,62 @@ class Named(object):
         else:
             self._namespace = p[0] or None
             self._name = p[1] or "/"
-        return self._name, self._namespace
 
     @property
     def name(self):
-        return self._name if hasattr(self, "_name") else self._parse()[0]
+        try:
+            return self._name
+        except AttributeError:
+            self._parse()
+            return self._name
 
     @property
     def namespace(self):
-        return self._namespace if hasattr(self, "_namespace") \
-                               else self._parse()[1]
-
-
-class Keyword(Named):
-    def __init__(self, value):
-        assert isinstance(value, string_types)
-        self.str = value
-        self.hv = value.__hash__()
+        try:
+            return self._namespace
+        except AttributeError:
+            self._parse()
+            return self._namespace
 
     def __hash__(self):
         return self.hv
 
-    def __eq__(self, other):
-        return isinstance(other, Keyword) and self.str == other.str
-
     def __ne__(self, other):
         return not self == other
 
     def __call__(self, mp):
         return mp[self]
 
-    def __repr__(self):
-        return "<Keyword " + self.str + ">"
-
     def __str__(self):
         return self.str
 
+    def __reduce__(self):
+        return (self.__class__, (self.str,))
 
-class Symbol(Named):
-    def __init__(self, value):
-        assert isinstance(value, string_types)
-        self.str = value
-        self.hv = value.__hash__()
 
-    def __hash__(self):
-        return self.hv
+class Keyword(Named):
+    __slots__ = ()
 
     def __eq__(self, other):
-        return isinstance(other, Symbol) and self.str == other.str
+        return other is self or \
+            isinstance(other, Keyword) and self.str == other.str
 
-    def __ne__(self, other):
-        return not self == other
-
-    def __call__(self, mp):
-        return mp[self]
+    __hash__ = Named.__hash__
 
     def __repr__(self):
-        return self.str
+        return "<Keyword " + self.str + ">"
 
-    def __str__(self):
+
+class Symbol(Named):
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return other is self or \
+            isinstance(other, Symbol) and self.str == other.str
+
+    __hash__ = Named.__hash__
+
+    def __repr__(self):
         return self.str
 
 kw_cache = {}
@@ -107,7 +112,15 @@ class _KWS(object):
 kws = _KWS()
 
 
+def _tagged_value(cls, tag, rep):
+    tv = cls.__new__(cls)
+    TaggedValue.__init__(tv, tag, rep)
+    return tv
+
+
 class TaggedValue(object):
+    __slots__ = ("tag", "rep", "_hash")
+
     def __init__(self, tag, rep):
         self.tag = tag
         self.rep = rep
@@ -122,9 +135,16 @@ class TaggedValue(object):
         return not (self == other)
 
     def __hash__(self):
-        if isinstance(self.rep, list):
-            return reduce(lambda a, b: hash(a) ^ hash(b), self.rep, 0)
-        return hash(self.rep)
+        try:
+            return self._hash
+        except AttributeError:
+            rep = self.rep
+            self._hash = hash(tuple(rep) if isinstance(rep, list) else rep)
+            return self._hash
+
+    def __reduce__(self):
+        # the cached hash is left out; string hashes differ between runs
+        return (_tagged_value, (self.__class__, self.tag, self.rep))
 
     def __str__(self):
         return repr(self)
@@ -134,57 +154,106 @@ class TaggedValue(object):
 
 
 class Set(TaggedValue):
+    __slots__ = ()
+
     def __init__(self, rep):
         TaggedValue.__init__(self, "set", rep)
 
 
 class CMap(TaggedValue):
+    __slots__ = ()
+
     def __init__(self, rep):
         TaggedValue.__init__(self, "cmap", rep)
 
 
 class Vector(TaggedValue):
+    __slots__ = ()
+
     def __init__(self, rep):
         TaggedValue.__init__(self, "vector", rep)
 
 
 class Array(TaggedValue):
+    __slots__ = ()
+
     def __init__(self, rep):
         TaggedValue.__init__(self, "array", rep)
 
 
 class List(TaggedValue):
+    __slots__ = ()
+
     def __init__(self, rep):
         TaggedValue.__init__(self, "list", rep)
 
 
 class URI(TaggedValue):
+    __slots__ = ()
+
     def __init__(self, rep):
         # works p3 TaggedValue.__init__(self, "uri", (unicode(rep)))
         TaggedValue.__init__(self, "uri", (rep))
 
 
-class frozendict(Mapping, Hashable):
+class frozendict(dict):
+    """An immutable dict.  Reads are plain dict reads; the methods that
+    would modify it raise TypeError, and its hash is computed on first use
+    and cached.
+    """
+    __slots__ = ("_hash",)
+
+    def __new__(cls, *args, **kwargs):
+        self = dict.__new__(cls)
+        dict.__init__(self, *args, **kwargs)
+        return self
+
     def __init__(self, *args, **kwargs):
-        self._dict = dict(*args, **kwargs)
+        # filled by __new__, so calling __init__ again changes nothing
+        pass
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("frozendict is immutable")
 
-    def __len__(self):
-        return len(self._dict)
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
 
-    def __iter__(self):
-        return iter(self._dict)
+    @classmethod
+    def fromkeys(cls, iterable, value=None):
+        return cls(dict.fromkeys(iterable, value))
 
-    def __getitem__(self, key):
-        return self._dict[key]
+    def copy(self):
+        return self
 
     def __hash__(self):
-        return hash(frozenset(self._dict.items()))
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __reduce__(self):
+        return (frozendict, (dict(self),))
 
     def __repr__(self):
-        return 'frozendict(%r)' % (self._dict,)
+        return 'frozendict(%s)' % dict.__repr__(self)
+
+
+class FrozenDictBuilder(dict):
+    """A mutable dict with the layout of frozendict, for decoders to fill
+    one entry at a time.  freeze turns it into a frozendict in place, so
+    the entries are not copied; the builder must not be used afterwards.
+    """
+    __slots__ = ("_hash",)
+
+    def freeze(self):
+        self.__class__ = frozendict
+        return self
 
 
 class Link(object):
+    __slots__ = ("href", "rel", "name", "render", "prompt")
+
     # Class property constants for rendering types
     LINK = u"link"
     IMAGE = u"image"
@@ -198,45 +267,31 @@ class Link(object):
 
     def __init__(self, href=None, rel=None, name=None, render=None,
                  prompt=None):
-        self._dict = frozendict()
         assert href and rel
         if render:
             assert render.lower() in [Link.LINK, Link.IMAGE]
-        self._dict = {Link.HREF: href,
-                      Link.REL: rel,
-                      Link.NAME: name,
-                      Link.RENDER: render,
-                      Link.PROMPT: prompt}
+        self.href = href
+        self.rel = rel
+        self.name = name
+        self.render = render
+        self.prompt = prompt
 
     def __eq__(self, other):
-        return self._dict == other._dict
+        return isinstance(other, Link) and self.as_array == other.as_array
 
     def __ne__(self, other):
-        return self._dict != other._dict
-
-    @property
-    def href(self):
-        return self._dict[Link.HREF]
-
-    @property
-    def rel(self):
-        return self._dict[Link.REL]
-
-    @property
-    def prompt(self):
-        return self._dict[Link.PROMPT]
+        return not self == other
 
-    @property
-    def name(self):
-        return self._dict[Link.NAME]
-
-    @property
-    def render(self):
-        return self._dict[Link.RENDER]
+    def __reduce__(self):
+        return (Link, tuple(self.as_array))
 
     @property
     def as_map(self):
-        return self._dict
+        return {Link.HREF: self.href,
+                Link.REL: self.rel,
+                Link.NAME: self.name,
+                Link.RENDER: self.render,
+                Link.PROMPT: self.prompt}
 
     @property
     def as_array(self):
@@ -252,6 +307,8 @@ class Boolean(object):
     as an int, they're not). You can get a Python bool using bool(x)
     where x is a true or false Boolean.
     """
+    __slots__ = ("v", "name")
+
     def __init__(self, name):
         self.v = True if name == "true" else False
         self.name = name
@@ -268,6 +325,10 @@ class Boolean(object):
     def __str__(self):
         return self.name
 
+    def __reduce__(self):
+        # unpickles to the module's true/false singleton
+        return self.name
+
 # lowercase rep matches java/clojure
 
 false = Boolean("false")
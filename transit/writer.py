@@ -13,27 +13,20 @@
 ## limitations under the License.
 
 import sys
+import json
 import msgpack
 import re
+from importlib import import_module
+from io import StringIO
+from json.encoder import encode_basestring, encode_basestring_ascii
 from transit import pyversion
 from transit.constants import SUB, ESC, RES, MAP_AS_ARR, QUOTE
-from transit.rolling_cache import RollingCache
+from transit.helpers import pairs
+from transit.rolling_cache import WriteCache
+from transit import write_handlers as wh
 from transit.write_handlers import WriteHandler
 from transit.transit_types import TaggedValue
 
-ESCAPE_DCT = {
-    '\\': u'\\\\',
-    '"': u'\\"',
-    '\b': u'\\b',
-    '\f': u'\\f',
-    '\n': u'\\n',
-    '\r': u'\\r',
-    '\t': u'\\t',
-}
-for i in range(0x20):
-    ESCAPE_DCT.setdefault(chr(i), '\\u{0:04x}'.format(i))
-
-
 
 class Writer(object):
     """The top-level object for writing out Python objects and converting them
@@ -42,12 +35,22 @@ class Writer(object):
     source used for writing (a file descriptor).  You may optionally pass in
     an options dictionary that will be forwarded onto the Marshaler.
     The cache is enabled by default.
+
+    For the JSON protocols, passing a 'backend' option selects a Marshaler
+    that builds a plain tree for each value and serializes it in a single
+    call to that backend (see JsonTreeMarshaler).
     """
     def __init__(self, io, protocol="json", opts={"cache_enabled": True}):
         if protocol == "json":
-            self.marshaler = JsonMarshaler(io, opts=opts)
+            if "backend" in opts:
+                self.marshaler = JsonTreeMarshaler(io, opts=opts)
+            else:
+                self.marshaler = JsonMarshaler(io, opts=opts)
         elif protocol == "json_verbose":
-            self.marshaler = VerboseJsonMarshaler(io, opts=opts)
+            if "backend" in opts:
+                self.marshaler = VerboseJsonTreeMarshaler(io, opts=opts)
+            else:
+                self.marshaler = VerboseJsonMarshaler(io, opts=opts)
         elif protocol == "msgpack":
             self.marshaler = MsgPackMarshaler(io, opts=opts)
         else:
@@ -60,6 +63,23 @@ class Writer(object):
         """
         self.marshaler.marshal_top(obj)
 
+    def session(self, flush_every=1000, flush_bytes=1048576):
+        """Return a WriterSession for writing many top-level values through
+        this Writer.  Use it as a context manager so that the output is
+        flushed when the session ends.
+        """
+        return WriterSession(self.marshaler, flush_every, flush_bytes)
+
+    def write_many(self, objs, flush_every=1000, flush_bytes=1048576):
+        """Write each object of an iterable as its own top-level value,
+        flushing the 'io' source once every 'flush_every' values, whenever
+        'flush_bytes' of output are pending (see WriterSession) and at the
+        end.
+        """
+        with self.session(flush_every, flush_bytes) as session:
+            for obj in objs:
+                session.write(obj)
+
     def register(self, obj_type, handler_class):
         """Register custom converters for object types present in your
         application.  This allows you to extend Transit to encode new types.
@@ -69,6 +89,46 @@ class Writer(object):
         self.marshaler.register(obj_type, handler_class)
 
 
+class WriterSession(object):
+    """Writes many top-level values through one Marshaler.  A single cache
+    is recycled across values (and cleared before each one, as every value
+    gets its own cache), and the io is flushed once every 'flush_every'
+    values, or once at least 'flush_bytes' bytes (characters for JSON) of
+    output are pending, instead of after each value.  The tree-building
+    JSON marshaler only encodes its output on flush, so for it just the
+    count applies.  Obtain one from Writer.session.
+
+    If the body of a with statement raises, the output of a value that was
+    not completely written is dropped, and the complete values are flushed.
+    """
+    def __init__(self, marshaler, flush_every=1000, flush_bytes=1048576):
+        self.marshaler = marshaler
+        self.flush_every = flush_every
+        self.flush_bytes = flush_bytes
+        self.cache = WriteCache()
+        self.pending = 0
+
+    def write(self, obj):
+        self.cache.clear()
+        self.marshaler.emit_top(obj, self.cache)
+        self.pending += 1
+        if self.pending >= self.flush_every or \
+                self.marshaler.pending_size() >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        self.marshaler.flush()
+        self.pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.marshaler.discard()
+        self.flush()
+
+
 def flatten_map(m):
     """Expand a dictionary's items into a flat list
     """
@@ -101,14 +161,48 @@ class Marshaler(object):
     The Marshaler specifies how to emit Transit data given encodeable Python
     objects.  The end of this process is specialized by other Marshalers to
     covert the final result into an on-the-wire payload (JSON or MsgPack).
+
+    The first DIRECT_DEPTH levels of nested containers are marshaled by
+    recursion, deeper ones with an explicit stack, so the depth of the data
+    is not limited by Python's recursion limit.  Set the 'max_depth' option
+    to reject data with more levels of nested containers with a ValueError.
     """
+    DIRECT_DEPTH = 32
+
     def __init__(self, opts={}):
         self.opts = opts
+        self.max_depth = opts.get("max_depth")
+        self.direct_depth = self.DIRECT_DEPTH if self.max_depth is None \
+            else min(self.DIRECT_DEPTH, self.max_depth)
+        # Number of containers open in direct (recursive) marshaling.
+        self.depth = 0
         self._init_handlers()
+        # Exact type -> emitter function, resolved the first time a type is
+        # marshaled (top_dispatch: as a top-level value).  Cleared by register.
+        self.dispatch = {}
+        self.top_dispatch = {}
 
     def _init_handlers(self):
         self.handlers = WriteHandler()
 
+    def resolve_dispatch(self, obj_type):
+        """Look up the handler for obj_type and cache the emitter used to
+        marshal values of exactly that type.
+        """
+        handler = self.handlers[obj_type]
+        f = handler_emitters.get(handler) or handler_emitter(handler)
+        self.dispatch[obj_type] = f
+        return f
+
+    def resolve_top_dispatch(self, obj_type):
+        """Look up the handler for obj_type and cache the emitter used to
+        marshal top-level values of exactly that type.
+        """
+        handler = self.handlers[obj_type]
+        f = top_emitters.get(handler) or top_emitter(handler)
+        self.top_dispatch[obj_type] = f
+        return f
+
     def are_stringable_keys(self, m):
         """Test whether the keys within a map are stringable - a simple map,
         that can be optimized and whose keys can be cached
@@ -123,9 +217,6 @@ class Marshaler(object):
 
     def emit_string(self, prefix, tag, string, as_map_key, cache):
         encoded = cache.encode(str(prefix)+tag+string, as_map_key)
-        # TODO: Remove this optimization for the time being - it breaks cache
-        #if "cache_enabled" in self.opts and is_cacheable(encoded, as_map_key):
-        #    return self.emit_object(cache.value_to_key[encoded], as_map_key)
         return self.emit_object(encoded, as_map_key)
 
     def emit_boolean(self, b, as_map_key, cache):
@@ -140,52 +231,119 @@ class Marshaler(object):
     def emit_double(self, d, as_map_key, cache):
         return self.emit_string(ESC, "d", d, True, cache) if as_map_key else self.emit_object(d)
 
+    # Container emitters write the container by recursion, or past the
+    # direct depth return a generator that writes it.  Each child is emitted
+    # with emit_value; a child that is itself a container then returns its
+    # own generator, which is yielded for run_stack to run before this one
+    # resumes.
+
     def emit_array(self, a, _, cache):
+        if self.depth >= self.direct_depth:
+            return self.iter_array(a, cache)
+        self.depth += 1
+        self.emit_array_start(len(a))
+        emit = self.emit_value
+        for x in a:
+            children = emit(x, False, cache)
+            if children is not None:
+                self.run_stack(children)
+        self.emit_array_end()
+        self.depth -= 1
+
+    def iter_array(self, a, cache):
         self.emit_array_start(len(a))
+        emit = self.emit_value
         for x in a:
-            self.marshal(x, False, cache)
+            children = emit(x, False, cache)
+            if children is not None:
+                yield children
         self.emit_array_end()
 
     def emit_map(self, m, _, cache):# use map as object from above, have to overwrite default parser.
+        if self.depth >= self.direct_depth:
+            return self.iter_map(m, cache)
+        self.depth += 1
+        self.emit_map_start(len(m))
+        emit = self.emit_value
+        for k, v in m.items():
+            children = emit(k, True, cache)
+            if children is not None:
+                self.run_stack(children)
+            children = emit(v, False, cache)
+            if children is not None:
+                self.run_stack(children)
+        self.emit_map_end()
+        self.depth -= 1
+
+    def iter_map(self, m, cache):
         self.emit_map_start(len(m))
+        emit = self.emit_value
         for k, v in m.items():
-            self.marshal(k, True, cache)
-            self.marshal(v, False, cache)
+            children = emit(k, True, cache)
+            if children is not None:
+                yield children
+            children = emit(v, False, cache)
+            if children is not None:
+                yield children
         self.emit_map_end()
 
     def emit_cmap(self, m, _, cache):
+        if self.depth >= self.direct_depth:
+            return self.iter_cmap(m, cache)
+        self.depth += 1
         self.emit_map_start(1)
         self.emit_string(ESC, "#", "cmap", True, cache)
         self.marshal(flatten_map(m), False, cache)
         self.emit_map_end()
+        self.depth -= 1
+
+    def iter_cmap(self, m, cache):
+        self.emit_map_start(1)
+        self.emit_string(ESC, "#", "cmap", True, cache)
+        children = self.emit_value(flatten_map(m), False, cache)
+        if children is not None:
+            yield children
+        self.emit_map_end()
 
     def emit_tagged(self, tag, rep, cache):
+        if self.depth >= self.direct_depth:
+            return self.iter_tagged(tag, rep, cache)
+        self.depth += 1
         self.emit_array_start(2)
         self.emit_string(ESC, "#", tag, False, cache)
         self.marshal(rep, False, cache)
         self.emit_array_end()
+        self.depth -= 1
+
+    def iter_tagged(self, tag, rep, cache):
+        self.emit_array_start(2)
+        self.emit_string(ESC, "#", tag, False, cache)
+        children = self.emit_value(rep, False, cache)
+        if children is not None:
+            yield children
+        self.emit_array_end()
 
     def emit_encoded(self, tag, handler, obj, as_map_key, cache):
         rep = handler.rep(obj)
         if len(tag) == 1:
             if isinstance(rep, pyversion.string_types):
-                self.emit_string(ESC, tag, rep, as_map_key, cache)
+                return self.emit_string(ESC, tag, rep, as_map_key, cache)
             elif as_map_key or self.opts["prefer_strings"]:
                 rep = handler.string_rep(obj)
                 if isinstance(rep, pyversion.string_types):
-                    self.emit_string(ESC, tag, rep, as_map_key, cache)
+                    return self.emit_string(ESC, tag, rep, as_map_key, cache)
                 else:
                     raise AssertionError("Cannot be encoded as string: " + str({"tag": tag,
                                                                                 "rep": rep,
                                                                                 "obj": obj}))
             else:
-                self.emit_tagged(tag, rep, cache)
+                return self.emit_tagged(tag, rep, cache)
         elif as_map_key:
             raise AssertionError("Cannot be used as a map key: " + str({"tag": tag,
                                                                         "rep": rep,
                                                                         "obj": obj}))
         else:
-            self.emit_tagged(tag, rep, cache)
+            return self.emit_tagged(tag, rep, cache)
 
     def marshal(self, obj, as_map_key, cache):
         """Marshal an individual obj, potentially as part of another container
@@ -194,14 +352,43 @@ class Marshaler(object):
         This method should only be called by a top-level marshalling call
         and should not be considered an entry-point for integration.
         """
-        handler = self.handlers[obj]
-        tag = handler.tag(obj)
-        f = marshal_dispatch.get(tag)
+        children = self.emit_value(obj, as_map_key, cache)
+        if children is not None:
+            self.run_stack(children)
+
+    def run_stack(self, children):
+        """Run the generator of a container past the direct depth.  The
+        generators of the open containers are kept on an explicit stack,
+        innermost last, and each is resumed until it yields a nested
+        container's generator or finishes.
+        """
+        max_depth = self.max_depth
+        if max_depth is not None:
+            max_depth -= self.depth
+            if max_depth <= 0:
+                self.too_deep()
+        stack = [children]
+        while stack:
+            for children in stack[-1]:
+                if max_depth is not None and len(stack) >= max_depth:
+                    self.too_deep()
+                stack.append(children)
+                break
+            else:
+                stack.pop()
 
-        if f:
-            f(self, obj, handler.string_rep(obj) if as_map_key else handler.rep(obj), as_map_key, cache)
-        else:
-            self.emit_encoded(tag, handler, obj, as_map_key, cache)
+    def too_deep(self):
+        raise ValueError("Data nested deeper than max_depth (%d)"
+                         % self.max_depth)
+
+    def emit_value(self, obj, as_map_key, cache):
+        """Emit obj with the emitter for its type.  Returns None once obj has
+        been written, or, for a container, a generator that writes it,
+        yielding the generators of nested containers in turn.
+        """
+        tp = type(obj)
+        f = self.dispatch.get(tp) or self.resolve_dispatch(tp)
+        return f(self, obj, as_map_key, cache)
 
     def marshal_top(self, obj, cache=None):
         """Given a complete object that needs to be marshaled into Transit
@@ -209,19 +396,32 @@ class Marshaler(object):
         directly into the IO stream.
         """
         if not cache:
-            cache = RollingCache()
-
-        handler = self.handlers[obj]
+            cache = WriteCache()
+        self.emit_top(obj, cache)
+        self.flush()
+
+    def emit_top(self, obj, cache):
+        """Marshal obj as a complete top-level value using the given cache,
+        without flushing.  Scalars are quoted.  If marshaling fails, the
+        output of the partly written value is discarded.
+        """
+        tp = type(obj)
+        f = self.top_dispatch.get(tp) or self.resolve_top_dispatch(tp)
+        try:
+            f(self, obj, cache)
+        except Exception:
+            self.discard()
+            raise
+
+    def discard(self):
+        """Drop the pending output of a value that was not completely
+        written, keeping complete values that wait for a flush.
+        """
+        self.depth = 0
 
-        tag = handler.tag(obj)
-        if tag:
-            if len(tag) == 1:
-                self.marshal(TaggedValue(QUOTE, obj), False, cache)
-            else:
-                self.marshal(obj, False, cache)
-            self.flush()
-        else:
-            raise AssertionError("Handler must provide a non-nil tag: " + str(handler))
+    def pending_size(self):
+        """The size of the output waiting for a flush, or 0 if unknown."""
+        return 0
 
     def dispatch_map(self, rep, as_map_key, cache):
         """Used to determine and dipatch the writing of a map - a simple
@@ -239,6 +439,8 @@ class Marshaler(object):
         that should be used by this marshaller.
         """
         self.handlers[obj_type] = handler_class
+        self.dispatch.clear()
+        self.top_dispatch.clear()
 
 marshal_dispatch = {"_": lambda self, obj, rep, as_map_key, cache: self.emit_nil(rep, as_map_key, cache),
                     "?": lambda self, obj, rep, as_map_key, cache: self.emit_boolean(rep, as_map_key, cache),
@@ -251,6 +453,62 @@ marshal_dispatch = {"_": lambda self, obj, rep, as_map_key, cache: self.emit_nil
                     "map": lambda self, obj, rep, as_map_key, cache: self.dispatch_map(rep, as_map_key, cache)}
 
 
+def handler_emitter(handler):
+    """Return the generic emitter for a handler, which resolves the tag and
+    rep of every value it is given.
+    """
+    def emit(self, obj, as_map_key, cache):
+        tag = handler.tag(obj)
+        f = marshal_dispatch.get(tag)
+
+        if f:
+            return f(self, obj, handler.string_rep(obj) if as_map_key else handler.rep(obj), as_map_key, cache)
+        else:
+            return self.emit_encoded(tag, handler, obj, as_map_key, cache)
+    return emit
+
+# Specialized emitters for built-in handlers whose tag does not depend on the
+# value, skipping the tag/rep calls and the marshal_dispatch lookup.
+handler_emitters = {wh.NoneHandler: lambda self, _, as_map_key, cache: self.emit_nil(None, as_map_key, cache),
+                    wh.StringHandler: lambda self, s, as_map_key, cache: self.emit_string("", "", escape(s), as_map_key, cache),
+                    wh.KeywordHandler: lambda self, k, as_map_key, cache: self.emit_string(ESC, ":", str(k), as_map_key, cache),
+                    wh.SymbolHandler: lambda self, s, as_map_key, cache: self.emit_string(ESC, "$", str(s), as_map_key, cache),
+                    wh.ArrayHandler: lambda self, a, as_map_key, cache: self.emit_array(a, as_map_key, cache),
+                    wh.MapHandler: lambda self, m, as_map_key, cache: self.dispatch_map(m, as_map_key, cache)}
+
+
+def top_emitter(handler):
+    """Return the generic top-level emitter for a handler, which quotes
+    values whose tag is a single character.
+    """
+    def emit(self, obj, cache):
+        tag = handler.tag(obj)
+        if tag:
+            if len(tag) == 1:
+                self.marshal(TaggedValue(QUOTE, obj), False, cache)
+            else:
+                self.marshal(obj, False, cache)
+        else:
+            raise AssertionError("Handler must provide a non-nil tag: " + str(handler))
+    return emit
+
+
+def emit_quoted(self, obj, cache):
+    self.marshal(TaggedValue(QUOTE, obj), False, cache)
+
+
+def emit_unquoted(self, obj, cache):
+    self.marshal(obj, False, cache)
+
+# Top-level emitters for the built-in handlers with a fixed tag.
+top_emitters = {wh.NoneHandler: emit_quoted,
+                wh.StringHandler: emit_quoted,
+                wh.KeywordHandler: emit_quoted,
+                wh.SymbolHandler: emit_quoted,
+                wh.ArrayHandler: emit_unquoted,
+                wh.MapHandler: emit_unquoted}
+
+
 class MsgPackMarshaler(Marshaler):
     """The Marshaler tailor to MsgPack.  To use this Marshaler, specify the
     'msgpack' protocol when creating a Writer.
@@ -268,6 +526,22 @@ class MsgPackMarshaler(Marshaler):
         nopts = MsgPackMarshaler.default_opts.copy()
         nopts.update(opts)
         Marshaler.__init__(self, nopts)
+        # Size of the packed complete top-level values.
+        self.complete = 0
+
+    def emit_top(self, obj, cache):
+        Marshaler.emit_top(self, obj, cache)
+        self.complete = self.pending_size()
+
+    def discard(self):
+        # The packer cannot be truncated, so the complete values are written
+        # out and the rest is dropped.
+        Marshaler.discard(self)
+        complete = self.packer.bytes()[:self.complete]
+        self.packer.reset()
+        self.complete = 0
+        if complete:
+            self.io.write(complete)
 
     def emit_array_start(self, size):
         self.packer.pack_array_header(size)
@@ -284,10 +558,14 @@ class MsgPackMarshaler(Marshaler):
     def emit_object(self, obj, as_map_key=False):
         self.packer.pack(obj)
 
+    def pending_size(self):
+        return len(self.packer.getbuffer())
+
     def flush(self):
         self.io.write(self.packer.bytes())
         self.io.flush()
         self.packer.reset()
+        self.complete = 0
 
 REPLACE_RE = re.compile("\"")
 
@@ -295,13 +573,23 @@ REPLACE_RE = re.compile("\"")
 class JsonMarshaler(Marshaler):
     """The Marshaler tailor to JSON.  To use this Marshaler, specify the
     'json' protocol when creating a Writer.
+
+    Output is buffered by default and written to the io once per top-level
+    value.  Set the 'buffered' option to False to write every fragment
+    straight through, or lower 'flush_threshold' (a number of pending
+    characters) to bound the size of the buffer for very large values; the
+    buffer is drained before the next element once it holds that many.
+    Set 'ensure_ascii' to escape all non-ASCII characters in strings.
     """
     JSON_MAX_INT = pow(2, 53) - 1
     JSON_MIN_INT = -pow(2, 53) + 1
 
     default_opts = {"prefer_strings": True,
                     "max_int": JSON_MAX_INT,
-                    "min_int": JSON_MIN_INT}
+                    "min_int": JSON_MIN_INT,
+                    "buffered": True,
+                    "flush_threshold": 65536,
+                    "ensure_ascii": False}
 
     def __init__(self, io, opts={}):
         self.io = io
@@ -310,7 +598,53 @@ class JsonMarshaler(Marshaler):
         self.started = [True]
         self.is_key = [None]
         Marshaler.__init__(self, nopts)
-        self.flush = self.io.flush
+        # When buffered, output fragments are collected and handed to the io
+        # in one write per top-level value, or sooner once 'flush_threshold'
+        # characters are pending before the next element of a container.
+        # 'complete' is the length of the buffered output of complete values.
+        self.buffer = StringIO()
+        self.complete = 0
+        self.flush_threshold = self.opts["flush_threshold"]
+        if not self.opts["buffered"]:
+            self.write = self.io.write
+        elif pyversion.PY3:
+            self.write = self.buffer.write
+        else:
+            self.write = lambda s: self.buffer.write(pyversion.unicode_type(s))
+        # Quotes and escapes strings in C; 'ensure_ascii' additionally
+        # escapes all non-ASCII characters.
+        self.encode_string = encode_basestring_ascii if self.opts["ensure_ascii"] \
+                                                     else encode_basestring
+
+    def emit_top(self, obj, cache):
+        # Every top-level value is a JSON text of its own, written without a
+        # separator from the previous one.
+        self.started[0] = True
+        Marshaler.emit_top(self, obj, cache)
+        self.complete = self.buffer.tell()
+
+    def discard(self):
+        # Output that was already drained or written unbuffered stays.
+        Marshaler.discard(self)
+        del self.started[1:]
+        del self.is_key[1:]
+        self.buffer.seek(self.complete)
+        self.buffer.truncate()
+
+    def pending_size(self):
+        return self.buffer.tell()
+
+    def drain(self):
+        """Write any buffered output to the io without flushing it."""
+        if self.buffer.tell():
+            self.io.write(self.buffer.getvalue())
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        self.complete = 0
+
+    def flush(self):
+        self.drain()
+        self.io.flush()
 
     def push_level(self):
         self.started.append(True)
@@ -328,60 +662,160 @@ class JsonMarshaler(Marshaler):
         if self.started[-1]:
             self.started[-1] = False
         else:
+            if self.buffer.tell() >= self.flush_threshold:
+                self.drain()
             last = self.is_key[-1]
             if last:
-                self.io.write(u":")
+                self.write(u":")
                 self.is_key[-1] = False
             elif last is False:
-                self.io.write(u",")
+                self.write(u",")
                 self.is_key[-1] = True
             else:
-                self.io.write(u",")
+                self.write(u",")
 
     def emit_array_start(self, size):
         self.write_sep()
-        self.io.write(u"[")
+        self.write(u"[")
         self.push_level()
 
     def emit_array_end(self):
         self.pop_level()
-        self.io.write(u"]")
+        self.write(u"]")
 
     def emit_map(self, m, _, cache):
         """Emits array as per default JSON spec."""
+        if self.depth >= self.direct_depth:
+            return self.iter_map(m, cache)
+        self.depth += 1
+        self.emit_array_start(None)
+        emit = self.emit_value
+        emit(MAP_AS_ARR, False, cache)
+        for k, v in m.items():
+            children = emit(k, True, cache)
+            if children is not None:
+                self.run_stack(children)
+            children = emit(v, False, cache)
+            if children is not None:
+                self.run_stack(children)
+        self.emit_array_end()
+        self.depth -= 1
+
+    def iter_map(self, m, cache):
         self.emit_array_start(None)
-        self.marshal(MAP_AS_ARR, False, cache)
+        emit = self.emit_value
+        emit(MAP_AS_ARR, False, cache)
         for k, v in m.items():
-            self.marshal(k, True, cache)
-            self.marshal(v, False, cache)
+            children = emit(k, True, cache)
+            if children is not None:
+                yield children
+            children = emit(v, False, cache)
+            if children is not None:
+                yield children
         self.emit_array_end()
 
     def emit_map_start(self, size):
         self.write_sep()
-        self.io.write(u"{")
+        self.write(u"{")
         self.push_map()
 
     def emit_map_end(self):
         self.pop_level()
-        self.io.write(u"}")
+        self.write(u"}")
 
     def emit_object(self, obj, as_map_key=False):
         tp = type(obj)
         self.write_sep()
         if tp in pyversion.string_types:
-            self.io.write(u"\"")
-            self.io.write(u"".join([(ESCAPE_DCT[c]) if c in ESCAPE_DCT else c for c in obj]))
-            self.io.write(u"\"")
+            self.write(self.encode_string(obj))
         elif pyversion.isnumber_type(tp):
-            self.io.write(pyversion.unicode_type(obj))
+            self.write(pyversion.unicode_type(obj))
         elif tp is bool:
-            self.io.write(u"true" if obj else u"false")
+            self.write(u"true" if obj else u"false")
         elif obj is None:
-            self.io.write(u"null")
+            self.write(u"null")
         else:
           raise AssertionError("Don't know how to encode: " + str(obj) + " of type: " + str(type(obj)))
 
 
+def json_backend_options(name, ensure_ascii=False):
+    """Keyword arguments that make a known backend module's 'dumps' write
+    the same text as JsonMarshaler.
+    """
+    if name in ("json", "simplejson"):
+        return {"separators": (",", ":"), "ensure_ascii": ensure_ascii}
+    if name == "ujson":
+        return {"ensure_ascii": ensure_ascii, "escape_forward_slashes": False}
+    if name == "rapidjson":
+        return {"ensure_ascii": ensure_ascii}
+    return {}
+
+
+def json_backend(backend, ensure_ascii=False):
+    """Resolve the 'backend' option of JsonTreeMarshaler into a function
+    that serializes a plain tree.  The backend may be a callable, or the
+    name of a module providing a 'dumps' function ("json" by default).
+
+    For json, simplejson, ujson and rapidjson the output matches
+    JsonMarshaler, including 'ensure_ascii'.  Callables and other modules
+    (e.g. orjson) control their own escaping and whitespace: the output is
+    equivalent JSON, but not necessarily the same text.
+    """
+    if callable(backend):
+        return backend
+    name = backend or "json"
+    dumps = import_module(name).dumps
+    kwargs = json_backend_options(name, ensure_ascii)
+    if not kwargs:
+        return dumps
+    return lambda tree: dumps(tree, **kwargs)
+
+
+class JsonTreeMarshaler(JsonMarshaler):
+    """JsonMarshaler that converts each top-level value into a plain tree of
+    lists, dicts, strings and numbers - with transit tagging, escaping and
+    caching already applied - and hands the whole tree to a C-backed JSON
+    encoder on flush.  To use this Marshaler, pass a 'backend' option when
+    creating a Writer; see json_backend for the accepted values.
+    """
+    def __init__(self, io, opts={}):
+        JsonMarshaler.__init__(self, io, opts)
+        self.dumps = json_backend(self.opts.get("backend"),
+                                  self.opts["ensure_ascii"])
+        self.stack = [[]]
+
+    def emit_array_start(self, size):
+        self.stack.append([])
+
+    def emit_array_end(self):
+        a = self.stack.pop()
+        self.stack[-1].append(a)
+
+    def emit_map_start(self, size):
+        self.stack.append([])
+
+    def emit_map_end(self):
+        m = self.stack.pop()
+        self.stack[-1].append(dict(pairs(m)))
+
+    def emit_object(self, obj, as_map_key=False):
+        self.stack[-1].append(obj)
+
+    def discard(self):
+        JsonMarshaler.discard(self)
+        del self.stack[1:]
+
+    def flush(self):
+        top = self.stack[0]
+        for tree in top:
+            encoded = self.dumps(tree)
+            if not isinstance(encoded, pyversion.unicode_type):
+                encoded = encoded.decode("utf-8")
+            self.io.write(encoded)
+        del top[:]
+        self.io.flush()
+
+
 class VerboseSettings(object):
     """Mixin for JsonMarshaler that adds support for Verbose output/input.
     Verbosity is only suggest for debuging/inspecting purposes.
@@ -400,19 +834,60 @@ class VerboseSettings(object):
         return self.emit_object(pyversion.unicode_type(prefix) + tag + string, as_map_key)
 
     def emit_map(self, m, _, cache):
+        if self.depth >= self.direct_depth:
+            return self.iter_map(m, cache)
+        self.depth += 1
+        self.emit_map_start(len(m))
+        emit = self.emit_value
+        for k, v in m.items():
+            children = emit(k, True, cache)
+            if children is not None:
+                self.run_stack(children)
+            children = emit(v, False, cache)
+            if children is not None:
+                self.run_stack(children)
+        self.emit_map_end()
+        self.depth -= 1
+
+    def iter_map(self, m, cache):
         self.emit_map_start(len(m))
+        emit = self.emit_value
         for k, v in m.items():
-            self.marshal(k, True, cache)
-            self.marshal(v, False, cache)
+            children = emit(k, True, cache)
+            if children is not None:
+                yield children
+            children = emit(v, False, cache)
+            if children is not None:
+                yield children
         self.emit_map_end()
 
     def emit_tagged(self, tag, rep, cache):
+        if self.depth >= self.direct_depth:
+            return self.iter_tagged(tag, rep, cache)
+        self.depth += 1
         self.emit_map_start(1)
         self.emit_object(ESC + "#" + tag, True)
         self.marshal(rep, False, cache)
         self.emit_map_end()
+        self.depth -= 1
+
+    def iter_tagged(self, tag, rep, cache):
+        self.emit_map_start(1)
+        self.emit_object(ESC + "#" + tag, True)
+        children = self.emit_value(rep, False, cache)
+        if children is not None:
+            yield children
+        self.emit_map_end()
 
 
 class VerboseJsonMarshaler(VerboseSettings, JsonMarshaler):
     """JsonMarshaler class with VerboseSettings mixin."""
     pass  # all from inheritance and mixin
+
+
+class VerboseJsonTreeMarshaler(VerboseSettings, JsonTreeMarshaler):
+    """JsonTreeMarshaler class with VerboseSettings mixin."""
+    pass
+
+if pyversion.PY3:
+    from transit.async_writer import AsyncWriter